@@ -0,0 +1,126 @@
+"""Run extraction batch files (see extraction_template_v2.csv) without the GUI"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from processing import batch_row_parameters, extract_data
+from result_cache import ResultCache, DEFAULT_CACHE_DIR
+import timing
+
+def parse_shard(value):
+    """Parse 'i/n' (1 <= i <= n) into (i, n)."""
+    try:
+        shard_index, shard_count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected a shard as i/n, got {value}")
+    if not 1 <= shard_index <= shard_count:
+        raise argparse.ArgumentTypeError(f"The shard index must be between 1 and {shard_count}")
+    return shard_index, shard_count
+
+def shard_rows(batch_data, shard_index, shard_count):
+    """Return (row_number, row) of every shard_count-th row starting with row shard_index (1-based).
+
+    Each node of a shared filesystem can run its own shard of the same batch file without any
+    coordination.
+
+    """
+    return [(position + 1, row) for position, (_, row) in enumerate(batch_data.iterrows()) if position % shard_count == shard_index - 1]
+
+def run_batch_row(row_number, row, cache_directory=None, cache_max_bytes=0, record_timings=False):
+    """Run one batch row and return its summary record; errors are recorded instead of raised.
+
+    With record_timings the record includes the time spent per stage and folder. A row with a
+    folder that could not be extracted is marked failed, with the error of every such folder in
+    'folder_errors'.
+
+    """
+    cache = ResultCache(cache_directory, cache_max_bytes) if cache_directory and cache_max_bytes > 0 else None
+    record = {'row': row_number, 'input_folder': row.get('Parent Folder'), 'status': 'ok', 'outputs': [], 'error': None, 'folder_errors': {}}
+    timings = timing.StageTimings(track_memory=True) if record_timings else None
+    start = time.perf_counter()
+    try:
+        record['outputs'] = extract_data(cache=cache, on_status=lambda message: None, timings=timings, folder_errors=record['folder_errors'], **batch_row_parameters(row))
+        if record['folder_errors']:
+            record['status'] = 'failed'
+            record['error'] = f"{len(record['folder_errors'])} folders could not be processed"
+        elif not record['outputs']:
+            record['status'] = 'no data'
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = f"{type(e).__name__}: {e}"
+    record['seconds'] = time.perf_counter() - start
+    if cache is not None:
+        record['cache'] = {'hits': cache.hits, 'misses': cache.misses}
+    if timings is not None:
+        record['timings'] = timings.to_dict()
+    return record
+
+def run_batch(batch_data, jobs=1, shard=(1, 1), cache_directory=None, cache_max_bytes=0, on_row_done=None, record_timings=False):
+    """Run the rows of one shard of a batch, jobs rows at a time; returns the records ordered by row."""
+    rows = shard_rows(batch_data, *shard)
+    records = []
+    if jobs <= 1 or len(rows) <= 1:
+        for row_number, row in rows:
+            records.append(run_batch_row(row_number, row, cache_directory, cache_max_bytes, record_timings))
+            if on_row_done:
+                on_row_done(records[-1])
+    else:
+        # every row runs in its own process; rows with Workers > 1 start their own pools from there
+        with ProcessPoolExecutor(max_workers=min(jobs, len(rows))) as executor:
+            futures = [executor.submit(run_batch_row, row_number, row, cache_directory, cache_max_bytes, record_timings) for row_number, row in rows]
+            for future in as_completed(futures):
+                records.append(future.result())
+                if on_row_done:
+                    on_row_done(records[-1])
+    return sorted(records, key=lambda record: record['row'])
+
+def summary_path(batch_file, shard):
+    base = os.path.splitext(batch_file)[0]
+    if shard == (1, 1):
+        return f"{base}_summary.json"
+    return f"{base}_summary_{shard[0]}of{shard[1]}.json"
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a tdfExtract batch file without the GUI.')
+    parser.add_argument('batch_file', type=str, help='Batch CSV file (see extraction_template_v2.csv)')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of batch rows processed at the same time')
+    parser.add_argument('--shard', type=parse_shard, default=(1, 1), help='Only run shard i of n (every n-th row starting with row i), e.g. 2/4')
+    parser.add_argument('--summary', type=str, help='Path of the JSON summary (default: <batch file>_summary[_<i>of<n>].json)')
+    parser.add_argument('--cache_dir', type=str, default=DEFAULT_CACHE_DIR, help='Result cache directory')
+    parser.add_argument('--cache_size', type=int, default=1024, help='Result cache size in MB, 0 disables the cache')
+    parser.add_argument('--timings', action='store_true', help='Add the time and peak memory (traced with tracemalloc, which slows the extraction down) per stage and folder of every row to the summary')
+    parser.add_argument('--profile', type=str, help='Write cProfile statistics of this process to this file (use with --jobs 1)')
+    args = parser.parse_args()
+
+    batch_data = pd.read_csv(args.batch_file)
+
+    def on_row_done(record):
+        print(f"row {record['row']}: {record['status']} in {record['seconds']:.1f} s ({record['input_folder']})"
+              + (f" {record['error']}" if record['error'] else ''), file=sys.stderr)
+
+    started = datetime.now().isoformat(timespec='seconds')
+    start = time.perf_counter()
+    with timing.profiled(args.profile):
+        records = run_batch(batch_data, args.jobs, args.shard, args.cache_dir, args.cache_size * 1024 * 1024, on_row_done, args.timings)
+    summary = {
+        'batch_file': os.path.abspath(args.batch_file),
+        'shard': list(args.shard),
+        'jobs': args.jobs,
+        'started': started,
+        'seconds': time.perf_counter() - start,
+        'failed': sum(record['status'] == 'failed' for record in records),
+        'rows': records,
+    }
+
+    output_path = args.summary or summary_path(args.batch_file, args.shard)
+    with open(output_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f"{len(records)} rows, {summary['failed']} failed, summary written to {output_path}", file=sys.stderr)
+    sys.exit(1 if summary['failed'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""Performance benchmarks for the tdfExtract extraction pipeline"""
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from timsdata import oneOverK0ToCCSforMz, ccsToOneOverK0ToCCSforMz, openTimsData
+from tims_ko_pull2 import extract_mobilogram, extract_mobilograms, analysis_mobility_range, mobility_grid_edges, extract_time_resolved_mobilogram, LiveMobilogram, \
+    MobilogramAccumulator, accumulate_frames, resolve_pressure_compensation_strategy
+from timsdata_synthetic import SCALES, write_synthetic_batch, write_synthetic_analysis, SyntheticTimsData
+from data_processing import process_folder
+from processing import write_window_output
+from output_writers import OUTPUT_FORMATS, write_matrix
+
+def time_call(func, repeat):
+    """Run func() repeat times and return (best wall time in seconds, last result)."""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def same_result(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    return np.array_equal(a['ko'].values, b['ko'].values) and np.array_equal(a['intensity'].values, b['intensity'].values)
+
+def bench_frame_shards(args):
+    print(f"{'workers':>8} {'seconds':>10} {'speedup':>8} {'identical':>10}")
+    reference = None
+    baseline = None
+    for workers in args.workers:
+        seconds, result = time_call(lambda: extract_mobilogram(args.input_folder, args.mzmin, args.mzmax,
+                                                              pressure_compensation_strategy=args.pressure_compensation_strategy,
+                                                              frame_workers=workers), args.repeat)
+        if reference is None:
+            reference, baseline = result, seconds
+        print(f"{workers:>8} {seconds:>10.3f} {baseline / seconds:>8.2f} {str(same_result(reference, result)):>10}")
+
+def boundary_windows(mz, width=1.0):
+    """Windows with a bound exactly on, just inside and just outside the m/z value of a peak, by name."""
+    below, above = np.nextafter(mz, -np.inf), np.nextafter(mz, np.inf)
+    return {
+        'lower on peak': (mz, mz + width), 'lower just below': (below, mz + width), 'lower just above': (above, mz + width),
+        'upper on peak': (mz - width, mz), 'upper just above': (mz - width, above), 'upper just below': (mz - width, below),
+    }
+
+def bench_filter_modes(args):
+    with tempfile.TemporaryDirectory() as parent_folder:
+        input_folder = args.input_folder
+        if input_folder is None:
+            os.environ['TDFEXTRACT_BACKEND'] = 'synthetic'
+            input_folder = os.path.join(parent_folder, 'synthetic.d')
+            write_synthetic_analysis(input_folder, num_frames=50, num_scans=200)
+
+        # the m/z values of peaks of the first frame, spread over its index range
+        with openTimsData(input_folder) as td:
+            frame = next(td.iter_frames(td.frames['Id'][:1]))
+            indices = np.unique(frame.indices)
+            picked = indices[np.linspace(0, len(indices) - 1, args.peaks).astype(int)]
+            peak_mzs = td.indexToMz(int(frame.frame_id), picked)
+
+        kinds = list(boundary_windows(peak_mzs[0]))
+        windows = [window for mz in peak_mzs for window in boundary_windows(float(mz)).values()]
+        index_seconds, by_index = time_call(lambda: extract_mobilograms(input_folder, windows, filter_mode='index'), args.repeat)
+        mz_seconds, by_mz = time_call(lambda: extract_mobilograms(input_folder, windows, filter_mode='mz'), args.repeat)
+
+    print(f"{len(peak_mzs)} peaks, index: {index_seconds:.3f} s, mz: {mz_seconds:.3f} s")
+    print(f"{'window':>18} {'identical':>10}")
+    for position, kind in enumerate(kinds):
+        pairs = list(zip(by_index, by_mz))[position::len(kinds)]
+        identical = sum(same_result(a, b) for a, b in pairs)
+        print(f"{kind:>18} {f'{identical}/{len(pairs)}':>10}")
+
+def retried_live_mobilogram(input_folder, failing_frame_id, **options):
+    """Follow an analysis that grows by the frames from failing_frame_id - 1 on, where reading failing_frame_id fails once.
+
+    The failing poll has read one new frame before the error. Returns the LiveMobilogram after
+    the failed poll has been retried.
+
+    """
+    conn = sqlite3.connect(os.path.join(input_folder, 'analysis.tdf'))
+    try:
+        later_frames = conn.execute("SELECT * FROM Frames WHERE Id >= ?", (failing_frame_id - 1,)).fetchall()
+        conn.execute("DELETE FROM Frames WHERE Id >= ?", (failing_frame_id - 1,))
+        conn.commit()
+        live = LiveMobilogram(input_folder, **options)
+        live.update()
+        conn.executemany(f"INSERT INTO Frames VALUES ({', '.join('?' * len(later_frames[0]))})", later_frames)
+        conn.commit()
+    finally:
+        conn.close()
+
+    read_scans = SyntheticTimsData.readScansDllBuffer
+    failed = []
+
+    def read_scans_failing_once(td, frame_id, *args, **kwargs):
+        if frame_id == failing_frame_id and not failed:
+            failed.append(frame_id)
+            raise RuntimeError("Frame not written yet.")
+        return read_scans(td, frame_id, *args, **kwargs)
+
+    SyntheticTimsData.readScansDllBuffer = read_scans_failing_once
+    try:
+        try:
+            live.update()
+        except RuntimeError:
+            pass
+        live.update()
+    finally:
+        SyntheticTimsData.readScansDllBuffer = read_scans
+    return live
+
+def bench_live_retry(args):
+    os.environ['TDFEXTRACT_BACKEND'] = 'synthetic'
+    windows = [(args.mzmin, args.mzmax)]
+    print(f"{'strategy':>16} {'grid':>6} {'identical':>10}")
+    for strategy in ('Global', 'Per-frame', 'No compensation'):
+        for bin_count in (None, 50):
+            with tempfile.TemporaryDirectory() as parent_folder:
+                input_folder = os.path.join(parent_folder, 'synthetic.d')
+                write_synthetic_analysis(input_folder, num_frames=args.frames, num_scans=200)
+                live = retried_live_mobilogram(input_folder, args.frames // 2, windows=windows, pressure_compensation_strategy=strategy, mobility_bin_count=bin_count)
+                edges = live.accumulator.edges if bin_count else None
+                full = extract_mobilograms(input_folder, windows, pressure_compensation_strategy=strategy, mobility_edges=edges)
+            print(f"{strategy:>16} {str(bin_count or '-'):>6} {str(same_result(live.to_frames()[0], full[0])):>10}")
+
+def per_frame_mobilograms(input_folder, windows, pressure_compensation_strategy):
+    """Accumulate every frame with its own mobility axis, the reference for the shared axis of global pressure compensation."""
+    accumulator = MobilogramAccumulator(len(windows))
+    with openTimsData(input_folder, use_recalibrated_state=True, pressure_compensation_strategy=resolve_pressure_compensation_strategy(pressure_compensation_strategy)) as td:
+        accumulate_frames(td, td.frames['Id'], windows, 'index', accumulator)
+    return accumulator.to_frames()
+
+def bench_calibrations(args):
+    os.environ['TDFEXTRACT_BACKEND'] = 'synthetic'
+    windows = [(args.mzmin, args.mzmax)]
+    recalibrate_at = args.frames // 2
+    print(f"{'strategy':>16} {'extract':>8} {'shards':>8} {'watch':>8}")
+    for strategy in ('Global', 'Per-frame', 'No compensation'):
+        with tempfile.TemporaryDirectory() as parent_folder:
+            input_folder = os.path.join(parent_folder, 'synthetic.d')
+            write_synthetic_analysis(input_folder, num_frames=args.frames, num_scans=200, recalibrate_at=recalibrate_at)
+            reference = per_frame_mobilograms(input_folder, windows, strategy)[0]
+            full = extract_mobilograms(input_folder, windows, pressure_compensation_strategy=strategy)[0]
+            sharded = extract_mobilograms(input_folder, windows, pressure_compensation_strategy=strategy, frame_workers=3)[0]
+            # the first poll ends before the recalibration, the retried one reads the frames after it
+            live = retried_live_mobilogram(input_folder, recalibrate_at + 1, windows=windows, pressure_compensation_strategy=strategy)
+            results = [same_result(result, reference) for result in (full, sharded, live.to_frames()[0])]
+        print(f"{strategy:>16} " + " ".join(f"{str(identical):>8}" for identical in results))
+
+def bench_windows(args):
+    windows = [tuple(window) for window in args.window]
+    separate_seconds, separate = time_call(lambda: [extract_mobilogram(args.input_folder, mzmin, mzmax) for mzmin, mzmax in windows], args.repeat)
+    single_pass_seconds, single_pass = time_call(lambda: extract_mobilograms(args.input_folder, windows), args.repeat)
+    first_seconds, _ = time_call(lambda: extract_mobilogram(args.input_folder, *windows[0]), args.repeat)
+    identical = all(same_result(a, b) for a, b in zip(separate, single_pass))
+    print(f"{len(windows)} windows, separate runs: {separate_seconds:.3f} s, single pass: {single_pass_seconds:.3f} s, "
+          f"one window: {first_seconds:.3f} s, identical: {identical}")
+
+def bench_mobility_grid(args):
+    ko_min, ko_max = analysis_mobility_range(args.input_folder, pressure_compensation_strategy=args.pressure_compensation_strategy)
+    edges = mobility_grid_edges(ko_min, ko_max, args.bin_width, args.bin_count)
+    native_seconds, native = time_call(lambda: extract_mobilogram(args.input_folder, args.mzmin, args.mzmax,
+                                                                  pressure_compensation_strategy=args.pressure_compensation_strategy), args.repeat)
+    binned_seconds, binned = time_call(lambda: extract_mobilogram(args.input_folder, args.mzmin, args.mzmax,
+                                                                  pressure_compensation_strategy=args.pressure_compensation_strategy,
+                                                                  mobility_edges=edges), args.repeat)
+    native_total = 0 if native is None else int(native['intensity'].sum())
+    binned_total = 0 if binned is None else int(binned['intensity'].sum())
+    print(f"native axis: {native_seconds:.3f} s ({0 if native is None else len(native)} rows), "
+          f"{len(edges) - 1} bins: {binned_seconds:.3f} s, intensity preserved: {native_total == binned_total}")
+
+def bench_chromatograms(args):
+    ko_min, ko_max = analysis_mobility_range(args.input_folder, pressure_compensation_strategy=args.pressure_compensation_strategy)
+    edges = mobility_grid_edges(ko_min, ko_max, args.bin_width, args.bin_count)
+    options = {'pressure_compensation_strategy': args.pressure_compensation_strategy}
+
+    def binned(mobilogram):
+        return np.zeros(len(edges) - 1, dtype=np.uint64) if mobilogram is None else mobilogram['intensity'].to_numpy()
+
+    # the time-resolved matrix only holds MS1 frames, so the summed reference does too
+    summed_seconds, summed = time_call(lambda: extract_mobilogram(args.input_folder, args.mzmin, args.mzmax, mobility_edges=edges, msms_types=[0], **options), args.repeat)
+    reference = binned(summed)
+    print(f"{len(edges) - 1} bins, {int(reference.sum())} total intensity")
+    print(f"{'method':>24} {'seconds':>9} {'identical':>10} {'max deviation':>14}")
+    print(f"{'summed (scan loop)':>24} {summed_seconds:>9.3f} {'':>10} {'':>14}")
+    for method in ('scans', 'chromatograms'):
+        try:
+            seconds, result = time_call(lambda: extract_time_resolved_mobilogram(args.input_folder, args.mzmin, args.mzmax, edges, method=method, **options), args.repeat)
+        except RuntimeError as e:
+            print(f"{'per frame (' + method + ')':>24}: {e}")
+            continue
+        sums = binned(result.summed())
+        # share of the total intensity in the bin that differs most from the scan loop
+        deviation = np.abs(sums.astype(np.int64) - reference.astype(np.int64)).max() / max(int(reference.sum()), 1)
+        print(f"{'per frame (' + method + ')':>24} {seconds:>9.3f} {str(np.array_equal(sums, reference)):>10} {deviation:>14.2e}")
+
+def bench_ccs(args):
+    ko = pd.Series(np.linspace(args.ko_min, args.ko_max, args.rows))
+    apply_seconds, per_row = time_call(lambda: ko.apply(lambda x: oneOverK0ToCCSforMz(x, args.charge, args.mz)).to_numpy(), args.repeat)
+    array_seconds, vectorized = time_call(lambda: oneOverK0ToCCSforMz(ko.to_numpy(), args.charge, args.mz), args.repeat)
+    max_error = np.max(np.abs(vectorized - per_row) / np.abs(per_row))
+    round_trip = np.max(np.abs(ccsToOneOverK0ToCCSforMz(vectorized, args.charge, args.mz) - ko.to_numpy()))
+    print(f"{args.rows} values, apply: {apply_seconds:.4f} s, array: {array_seconds:.4f} s, "
+          f"speedup: {apply_seconds / array_seconds:.1f}, max relative error: {max_error:.2e}, round trip error: {round_trip:.2e}")
+
+def bench_synthetic(args):
+    os.environ['TDFEXTRACT_BACKEND'] = 'synthetic'
+    mzmin, mzmax = args.mzmin, args.mzmax
+    print(f"{'scale':>8} {'peaks':>12} {'extract':>9} {'folder':>9} {'assembly':>9} {'batch':>9}")
+    for scale in args.scale:
+        with tempfile.TemporaryDirectory() as parent_folder:
+            paths = write_synthetic_batch(parent_folder, args.analyses, **SCALES[scale])
+            jobs = [(os.path.basename(path), path, str(10 * (n + 1))) for n, path in enumerate(paths)]
+            num_peaks = SCALES[scale]['num_frames'] * SCALES[scale]['num_scans'] * SCALES[scale]['peaks_per_scan'] * len(paths)
+
+            extract_seconds, _ = time_call(lambda: extract_mobilogram(paths[0], mzmin, mzmax), args.repeat)
+            folder_seconds, _ = time_call(lambda: process_folder(paths[0], mzmin, mzmax), args.repeat)
+            results = [process_folder(path, mzmin, mzmax) for path in paths]
+            assembly_seconds, _ = time_call(lambda: write_window_output(parent_folder, jobs, results, mzmin, mzmax, True), args.repeat)
+            batch_seconds, _ = time_call(lambda: write_window_output(parent_folder, jobs, [process_folder(path, mzmin, mzmax) for path in paths], mzmin, mzmax, True), args.repeat)
+        print(f"{scale:>8} {num_peaks:>12} {extract_seconds:>9.3f} {folder_seconds:>9.3f} {assembly_seconds:>9.3f} {batch_seconds:>9.3f}")
+
+def bench_output_formats(args):
+    rng = np.random.default_rng(0)
+    axis = np.sort(rng.uniform(0.6, 1.6, args.rows))
+    matrix = rng.integers(0, 100000, (args.rows, args.columns)).astype(np.uint64)
+    labels = [str(10 * (n + 1)) for n in range(args.columns)]
+    raw_files = [f"{label}V.d" for label in labels]
+    with tempfile.TemporaryDirectory() as output_folder:
+        for output_format in args.formats:
+            try:
+                seconds, path = time_call(lambda: write_matrix(os.path.join(output_folder, 'bench'), output_format, 'Mobility', axis, matrix, labels, raw_files, 500.0, 700.0), args.repeat)
+            except RuntimeError as e:
+                print(f"{output_format:>8}: {e}")
+                continue
+            print(f"{output_format:>8}: {seconds:.3f} s, {os.path.getsize(path) / 1e6:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the tdfExtract extraction pipeline.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    shards = subparsers.add_parser('frame-shards', help='Scaling of intra-analysis frame sharding')
+    shards.add_argument('input_folder', type=str, help='Path to the input .d folder')
+    shards.add_argument('--mzmin', type=float, required=True, help='Minimum mz value')
+    shards.add_argument('--mzmax', type=float, required=True, help='Maximum mz value')
+    shards.add_argument('--pressure_compensation_strategy', type=str, default='Global', help='Pressure compensation strategy to use')
+    shards.add_argument('--workers', type=lambda v: [int(w) for w in v.split(',')], default=[1, 2, 4, 8, 16], help='Comma-separated worker counts')
+    shards.add_argument('--repeat', type=int, default=3, help='Repetitions per measurement (best time is reported)')
+    shards.set_defaults(func=bench_frame_shards)
+
+    windows = subparsers.add_parser('windows', help='Single-pass multi-window extraction against one run per window')
+    windows.add_argument('input_folder', type=str, help='Path to the input .d folder')
+    windows.add_argument('--window', type=float, nargs=2, action='append', required=True, metavar=('MZMIN', 'MZMAX'), help='m/z window; give several times')
+    windows.add_argument('--repeat', type=int, default=3, help='Repetitions per measurement (best time is reported)')
+    windows.set_defaults(func=bench_windows)
+
+    filter_modes = subparsers.add_parser('filter-modes', help="TOF index filter against the m/z filter on windows bounded by peak m/z values")
+    filter_modes.add_argument('input_folder', type=str, nargs='?', help='Path to the input .d folder (default: a generated analysis, no timsdata.dll needed)')
+    filter_modes.add_argument('--peaks', type=int, default=20, help='Number of peaks to place window bounds on')
+    filter_modes.add_argument('--repeat', type=int, default=1, help='Repetitions per measurement (best time is reported)')
+    filter_modes.set_defaults(func=bench_filter_modes)
+
+    live_retry = subparsers.add_parser('live-retry', help='Watch mode after a poll that failed half way against a full extraction (no timsdata.dll needed)')
+    live_retry.add_argument('--frames', type=int, default=40, help='Frames of the generated analysis')
+    live_retry.add_argument('--mzmin', type=float, default=500.0, help='Minimum mz value')
+    live_retry.add_argument('--mzmax', type=float, default=700.0, help='Maximum mz value')
+    live_retry.set_defaults(func=bench_live_retry)
+
+    calibrations = subparsers.add_parser('calibrations', help='Extraction and watch mode of an analysis recalibrated half way against per-frame mobility axes (no timsdata.dll needed)')
+    calibrations.add_argument('--frames', type=int, default=40, help='Frames of the generated analysis')
+    calibrations.add_argument('--mzmin', type=float, default=500.0, help='Minimum mz value')
+    calibrations.add_argument('--mzmax', type=float, default=700.0, help='Maximum mz value')
+    calibrations.set_defaults(func=bench_calibrations)
+
+    grid = subparsers.add_parser('mobility-grid', help='Extraction onto a fixed 1/K0 grid against the native scan axis')
+    grid.add_argument('input_folder', type=str, help='Path to the input .d folder')
+    grid.add_argument('--mzmin', type=float, required=True, help='Minimum mz value')
+    grid.add_argument('--mzmax', type=float, required=True, help='Maximum mz value')
+    grid.add_argument('--pressure_compensation_strategy', type=str, default='Per-frame', help='Pressure compensation strategy to use')
+    grid.add_argument('--bin_width', type=float, help='1/K0 bin width')
+    grid.add_argument('--bin_count', type=int, default=500, help='Number of 1/K0 bins (ignored if --bin_width is given)')
+    grid.add_argument('--repeat', type=int, default=3, help='Repetitions per measurement (best time is reported)')
+    grid.set_defaults(func=bench_mobility_grid)
+
+    chromatograms = subparsers.add_parser('chromatograms', help='Time-resolved extraction with the chromatogram engine of timsdata.dll against the scan loop')
+    chromatograms.add_argument('input_folder', type=str, help='Path to the input .d folder')
+    chromatograms.add_argument('--mzmin', type=float, required=True, help='Minimum mz value')
+    chromatograms.add_argument('--mzmax', type=float, required=True, help='Maximum mz value')
+    chromatograms.add_argument('--pressure_compensation_strategy', type=str, default='Global', help='Pressure compensation strategy to use')
+    chromatograms.add_argument('--bin_width', type=float, help='1/K0 bin width')
+    chromatograms.add_argument('--bin_count', type=int, default=100, help='Number of 1/K0 bins, one chromatogram each (ignored if --bin_width is given)')
+    chromatograms.add_argument('--repeat', type=int, default=3, help='Repetitions per measurement (best time is reported)')
+    chromatograms.set_defaults(func=bench_chromatograms)
+
+    ccs = subparsers.add_parser('ccs', help='Array CCS conversion against one DLL call per row')
+    ccs.add_argument('--rows', type=int, default=100000, help='Number of 1/K0 values')
+    ccs.add_argument('--ko_min', type=float, default=0.6, help='Smallest 1/K0 value')
+    ccs.add_argument('--ko_max', type=float, default=1.6, help='Largest 1/K0 value')
+    ccs.add_argument('--charge', type=int, default=2, help='Charge state')
+    ccs.add_argument('--mz', type=float, default=600.0, help='m/z value')
+    ccs.add_argument('--repeat', type=int, default=3, help='Repetitions per measurement (best time is reported)')
+    ccs.set_defaults(func=bench_ccs)
+
+    synthetic = subparsers.add_parser('synthetic', help='Extraction, assembly and CSV output on generated data (no timsdata.dll needed)')
+    synthetic.add_argument('--scale', type=lambda v: v.split(','), default=['small', 'medium'], help=f"Comma-separated presets ({', '.join(SCALES)})")
+    synthetic.add_argument('--analyses', type=int, default=4, help='Analyses per batch')
+    synthetic.add_argument('--mzmin', type=float, default=500.0, help='Minimum mz value')
+    synthetic.add_argument('--mzmax', type=float, default=700.0, help='Maximum mz value')
+    synthetic.add_argument('--repeat', type=int, default=3, help='Repetitions per measurement (best time is reported)')
+    synthetic.set_defaults(func=bench_synthetic)
+
+    formats = subparsers.add_parser('output-formats', help='Write time and size of the output formats for a random matrix')
+    formats.add_argument('--rows', type=int, default=20000, help='Rows (mobility values) of the matrix')
+    formats.add_argument('--columns', type=int, default=100, help='Columns (analyses) of the matrix')
+    formats.add_argument('--formats', type=lambda v: v.split(','), default=list(OUTPUT_FORMATS), help='Comma-separated output formats')
+    formats.add_argument('--repeat', type=int, default=3, help='Repetitions per measurement (best time is reported)')
+    formats.set_defaults(func=bench_output_formats)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
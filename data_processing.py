@@ -1,18 +1,21 @@
 import os
 import sys
-import pandas as pd
 import re
 from file_utils import extract_voltage_from_method_file
-from tims_ko_pull2 import main as tims_main
-from io import StringIO
-import contextlib  
+from tims_ko_pull2 import extract_mobilograms, resolve_pressure_compensation_strategy
+from timsdata import timsDataBackend
+from result_cache import cache_key
+import timing
+import progress
 
 if getattr(sys, 'frozen', False):
     bundle_dir = sys._MEIPASS
     dll_path = os.path.join(bundle_dir, 'timsdata.dll')
-    os.add_dll_directory(os.path.dirname(dll_path))
+    if hasattr(os, 'add_dll_directory'):  # Windows only
+        os.add_dll_directory(os.path.dirname(dll_path))
 else:
-    os.add_dll_directory(os.getcwd())
+    if hasattr(os, 'add_dll_directory'):  # Windows only
+        os.add_dll_directory(os.getcwd())
     dll_path = os.path.join(os.getcwd(), 'timsdata.dll')
 
 def extract_column_name(folder_path, extraction_method):
@@ -30,25 +33,63 @@ def extract_column_name(folder_path, extraction_method):
         else:
             return os.path.basename(folder_path)
 
-def process_folder(d_folder_path, mzmin, mzmax, use_recalibrated_state=True, pressure_compensation_strategy="AnalysisGlobalPressureCompensation"):
-    try:
-        # Set the command-line arguments for tims_ko_pull2's main function
-        sys.argv = [
-            'tims_ko_pull2.py',
-            d_folder_path,
-            '--mzmin', str(mzmin),
-            '--mzmax', str(mzmax),
-            '--use_recalibrated_state', str(use_recalibrated_state),
-            '--pressure_compensation_strategy', pressure_compensation_strategy
-        ]
-        
-        output = StringIO()
-        with contextlib.redirect_stdout(output):
-            tims_main()
-
-        df = pd.read_csv(StringIO(output.getvalue()))
-        return df
+def folder_cache_key(d_folder_path, mzmin, mzmax, use_recalibrated_state=True, pressure_compensation_strategy="AnalysisGlobalPressureCompensation", **extraction_options):
+    # options left at their default (None) do not change the key
+    options = {name: value for name, value in extraction_options.items() if value is not None}
+    return cache_key(d_folder_path, mzmin=float(mzmin), mzmax=float(mzmax),
+                     use_recalibrated_state=bool(use_recalibrated_state),
+                     pressure_compensation_strategy=resolve_pressure_compensation_strategy(pressure_compensation_strategy).name,
+                     backend=timsDataBackend(), **options)
+
+def cached_results(cache, d_folder_path, windows, use_recalibrated_state=True, pressure_compensation_strategy="AnalysisGlobalPressureCompensation", **extraction_options):
+    """Look up every (mzmin, mzmax) window of a folder in the cache.
+
+    Returns (keys, results); a result is None on a miss and an empty DataFrame if the window is
+    known to contain no data.
+
+    """
+    keys = [folder_cache_key(d_folder_path, mzmin, mzmax, use_recalibrated_state, pressure_compensation_strategy, **extraction_options) for mzmin, mzmax in windows]
+    if cache is None:
+        return keys, [None] * len(windows)
+    with timing.folder(os.path.basename(d_folder_path)), timing.stage('cache'):
+        return keys, [cache.get(key) for key in keys]
+
+def extract_folder_windows(d_folder_path, windows, use_recalibrated_state=True, pressure_compensation_strategy="AnalysisGlobalPressureCompensation", frame_workers=1, cache=None, **extraction_options):
+    """Extract several (mzmin, mzmax) windows of one folder, reading its raw data at most once.
+
+    extraction_options (e.g. mobility_edges) are passed on to extract_mobilograms and are part of
+    the cache key. Returns one DataFrame (ko, intensity) or None per window; errors are raised.
 
+    """
+    progress.check_cancelled()
+    keys, results = cached_results(cache, d_folder_path, windows, use_recalibrated_state, pressure_compensation_strategy, **extraction_options)
+
+    missing = [idx for idx, df in enumerate(results) if df is None]
+    if missing:
+        with timing.folder(os.path.basename(d_folder_path)):
+            extracted = extract_mobilograms(d_folder_path, [windows[idx] for idx in missing], use_recalibrated_state=use_recalibrated_state, pressure_compensation_strategy=pressure_compensation_strategy, frame_workers=frame_workers, **extraction_options)
+        for idx, df in zip(missing, extracted):
+            results[idx] = df
+            if cache is not None:
+                cache.put(keys[idx], df)
+
+    return [None if df is None or df.empty else df for df in results]
+
+def record_folder_error(folder_errors, d_folder_path, error):
+    """Report a folder that could not be extracted and add it to folder_errors (a dict, or None)."""
+    print(f"Error processing folder {d_folder_path}: {error}")
+    if folder_errors is not None:
+        folder_errors[os.path.basename(d_folder_path)] = f"{type(error).__name__}: {error}"
+
+def process_folder_windows(d_folder_path, windows, use_recalibrated_state=True, pressure_compensation_strategy="AnalysisGlobalPressureCompensation", frame_workers=1, cache=None, **extraction_options):
+    """Like extract_folder_windows, but an error is printed and gives None for every window."""
+    try:
+        return extract_folder_windows(d_folder_path, windows, use_recalibrated_state, pressure_compensation_strategy, frame_workers, cache, **extraction_options)
+    except progress.Cancelled:
+        raise
     except Exception as e:
-        print(f"Error processing folder {d_folder_path}: {e}")
-        return None
+        record_folder_error(None, d_folder_path, e)
+        return [None] * len(windows)
+
+def process_folder(d_folder_path, mzmin, mzmax, use_recalibrated_state=True, pressure_compensation_strategy="AnalysisGlobalPressureCompensation", frame_workers=1, cache=None, **extraction_options):
+    return process_folder_windows(d_folder_path, [(mzmin, mzmax)], use_recalibrated_state, pressure_compensation_strategy, frame_workers, cache, **extraction_options)[0]
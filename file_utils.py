@@ -1,15 +1,18 @@
 import os
 import re
-import tkinter as tk
-from tkinter import simpledialog, filedialog
+# tkinter is imported by the dialog functions only, so that headless runs do not need it
 
 def select_folders():
+    import tkinter as tk
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()
     folder_paths = filedialog.askdirectory(title="Select one or more folders containing .d files", mustexist=True)
     return folder_paths.split()  
 
 def get_user_input(prompt, default_value):
+    import tkinter as tk
+    from tkinter import simpledialog
     root = tk.Tk()
     root.withdraw()
     user_input = simpledialog.askfloat(title="Input", prompt=prompt, initialvalue=default_value)
@@ -1,4 +1,7 @@
+from multiprocessing import freeze_support
 from ui import create_ui
 
 if __name__ == '__main__':
+    # required for worker processes in the frozen executable
+    freeze_support()
     create_ui()  
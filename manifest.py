@@ -0,0 +1,107 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+from result_cache import acquisition_fingerprint
+
+MANIFEST_NAME = 'tdfextract_manifest.json'
+# a lock is held for a read and a write of the manifest; an older one was left by a crashed run
+LOCK_TIMEOUT = 30.0
+
+def load_manifest(output_folder):
+    """Return the manifest of the outputs in output_folder ({} if there is none or it cannot be read)."""
+    try:
+        with open(os.path.join(output_folder, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+def save_manifest(output_folder, manifest):
+    # replace the file in one step so that an interrupted run never leaves a truncated manifest
+    path = os.path.join(output_folder, MANIFEST_NAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error writing manifest: {e}")
+
+@contextmanager
+def manifest_lock(output_folder, timeout=LOCK_TIMEOUT):
+    """Hold the lock file of the manifest in output_folder while the block runs.
+
+    The lock file is created exclusively, which also works between nodes sharing the folder over
+    a network filesystem. A lock file older than timeout seconds is removed.
+
+    """
+    lock_path = os.path.join(output_folder, MANIFEST_NAME + '.lock')
+    while True:
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > timeout:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue  # released in the meantime
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+def update_manifest(output_folder, recorded, removed=()):
+    """Add the entries in recorded (output name -> entry) to the manifest file and drop the outputs in removed.
+
+    The manifest is read again under the lock, so that runs writing other outputs of the same
+    folder at the same time (e.g. batch rows with the same Parent Folder) keep each other's
+    entries.
+
+    """
+    try:
+        with manifest_lock(output_folder):
+            manifest = load_manifest(output_folder)
+            for output_name in removed:
+                manifest.pop(output_name, None)
+            manifest.update(recorded)
+            save_manifest(output_folder, manifest)
+    except OSError as e:
+        print(f"Error writing manifest: {e}")
+
+def output_entry(jobs, parameters):
+    """Describe the inputs of one output: the extraction parameters and every (folder, column) with its fingerprint.
+
+    jobs holds (folder_name, folder_path, column_name) as in processing.extract_data.
+
+    """
+    entry = {
+        'parameters': parameters,
+        'folders': {folder_name: {'column': column_name, 'files': acquisition_fingerprint(folder_path)}
+                    for folder_name, folder_path, column_name in jobs},
+    }
+    # compare in the form the entry has after a round trip through the file
+    return json.loads(json.dumps(entry, default=str))
+
+def output_stat(output_file_path):
+    st = os.stat(output_file_path)
+    return [st.st_size, st.st_mtime_ns]
+
+def is_up_to_date(manifest, output_file_path, entry):
+    """True if output_file_path was written from exactly these inputs and has not been changed since."""
+    recorded = manifest.get(os.path.basename(output_file_path))
+    if recorded is None or recorded.get('parameters') != entry['parameters'] or recorded.get('folders') != entry['folders']:
+        return False
+    try:
+        return recorded.get('output') == output_stat(output_file_path)
+    except OSError:
+        return False
+
+def record_output(manifest, output_file_path, entry):
+    manifest[os.path.basename(output_file_path)] = dict(entry, output=output_stat(output_file_path))
@@ -0,0 +1,94 @@
+import os
+import csv
+import json
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# file extension of every output format; 'csv' keeps the original *_raw.csv layout
+OUTPUT_FORMATS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'hdf5': '.h5',
+}
+
+def output_metadata(axis_name, mzmin, mzmax, raw_files, labels):
+    """Description of a matrix stored with the binary formats (what the CSV keeps in its header rows)."""
+    return {
+        'mz_range': [float(mzmin), float(mzmax)],
+        'axis': axis_name,
+        'raw_files': list(raw_files),
+        'labels': list(labels),
+    }
+
+def unique_column_names(labels, raw_files):
+    """Column names for the binary formats: the labels (voltages), with the raw file name added to repeated ones."""
+    counts = pd.Series(labels).value_counts()
+    return [label if counts[label] == 1 else f"{label} ({raw_file})" for label, raw_file in zip(labels, raw_files)]
+
+def write_csv(output_file_path, axis_name, axis, matrix, labels, raw_files, mzmin, mzmax):
+    # header rows first, then the numeric matrix without converting it to strings as a whole
+    with open(output_file_path, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(['#mz range'] + [f'{mzmin}-{mzmax}'] * len(labels))
+        writer.writerow(['#Raw file name'] + list(raw_files))
+        writer.writerow([axis_name] + list(labels))
+        master_df = pd.DataFrame(matrix, columns=range(len(labels)))
+        master_df.insert(0, axis_name, axis)
+        master_df.to_csv(f, index=False, header=False)
+
+def arrow_table(axis_name, axis, matrix, labels, raw_files, mzmin, mzmax):
+    if pyarrow is None:
+        raise RuntimeError("Parquet and Feather output need the pyarrow package.")
+    columns = [pyarrow.array(axis)] + [pyarrow.array(matrix[:, column]) for column in range(matrix.shape[1])]
+    names = [axis_name] + unique_column_names(labels, raw_files)
+    metadata = output_metadata(axis_name, mzmin, mzmax, raw_files, labels)
+    return pyarrow.Table.from_arrays(columns, names=names, metadata={'tdfextract': json.dumps(metadata)})
+
+def write_parquet(output_file_path, axis_name, axis, matrix, labels, raw_files, mzmin, mzmax):
+    table = arrow_table(axis_name, axis, matrix, labels, raw_files, mzmin, mzmax)
+    pyarrow.parquet.write_table(table, output_file_path)
+
+def write_feather(output_file_path, axis_name, axis, matrix, labels, raw_files, mzmin, mzmax):
+    table = arrow_table(axis_name, axis, matrix, labels, raw_files, mzmin, mzmax)
+    pyarrow.feather.write_feather(table, output_file_path)
+
+def write_hdf5(output_file_path, axis_name, axis, matrix, labels, raw_files, mzmin, mzmax):
+    if h5py is None:
+        raise RuntimeError("HDF5 output needs the h5py package.")
+    with h5py.File(output_file_path, 'w') as f:
+        f.create_dataset(axis_name, data=axis)
+        f.create_dataset('intensity', data=matrix, compression='gzip')
+        for key, value in output_metadata(axis_name, mzmin, mzmax, raw_files, labels).items():
+            f.attrs[key] = json.dumps(value) if isinstance(value, list) else value
+
+WRITERS = {
+    'csv': write_csv,
+    'parquet': write_parquet,
+    'feather': write_feather,
+    'hdf5': write_hdf5,
+}
+
+def write_matrix(output_base_path, output_format, axis_name, axis, matrix, labels, raw_files, mzmin, mzmax):
+    """Write an assembled matrix (axis values x analyses) in output_format; returns the file path.
+
+    labels are the column names (voltages) and raw_files the analysis of every column.
+
+    """
+    if output_format not in WRITERS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    output_file_path = output_base_path + OUTPUT_FORMATS[output_format]
+    WRITERS[output_format](output_file_path, axis_name, np.asarray(axis), np.asarray(matrix), labels, raw_files, mzmin, mzmax)
+    return output_file_path
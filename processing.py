@@ -1,20 +1,292 @@
+import numpy as np
 import pandas as pd
 import os
 import re
-from timsdata import oneOverK0ToCCSforMz
-from tkinter import messagebox
-from data_processing import extract_column_name, process_folder, extract_voltage_from_method_file
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from timsdata import oneOverK0ToCCSforMz, ccsToOneOverK0ToCCSforMz, timsDataBackend
+from data_processing import extract_column_name, extract_folder_windows, record_folder_error, cached_results, extract_voltage_from_method_file
+from tims_ko_pull2 import analysis_mobility_range, mobility_grid_edges, parse_frame_ranges
+from output_writers import write_matrix, OUTPUT_FORMATS
+from manifest import load_manifest, update_manifest, output_entry, is_up_to_date, record_output
+import timing
+import progress
+
+def get_row_value(row, column, default=None):
+    value = row.get(column, default)
+    return default if pd.isna(value) else value
+
+def parse_values(value, convert=float):
+    """Convert a single value or a ';'-separated list (as used in batch files) to a list."""
+    if isinstance(value, (list, tuple)):
+        return [convert(v) for v in value]
+    if isinstance(value, str):
+        return [convert(v) for v in value.split(';') if v.strip()]
+    return [convert(value)]
+
+def mz_windows(mzmin, mzmax, charge=None, mz_value=None):
+    """Combine m/z window bounds and CCS parameters into a list of (mzmin, mzmax, charge, mz_value).
+
+    Every argument may be a single value or a list / ';'-separated string; single values apply
+    to all windows.
+
+    """
+    columns = [parse_values(mzmin), parse_values(mzmax),
+               parse_values(charge, int) if charge is not None else [None],
+               parse_values(mz_value) if mz_value is not None else [None]]
+    num_windows = max(len(values) for values in columns)
+    for values in columns:
+        if not values:
+            raise ValueError("Missing m/z window value.")
+        if len(values) not in (1, num_windows):
+            raise ValueError("All m/z window lists must have the same length.")
+    return [tuple(values[idx] if len(values) > 1 else values[0] for values in columns) for idx in range(num_windows)]
+
+def is_blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+def frame_selection_options(rt_min=None, rt_max=None, frame_ranges=None, msms_types=None):
+    """Convert a frame selection as entered in the UI or a batch file to the options of extract_mobilograms.
+
+    None or an empty string leaves a filter open.
+
+    """
+    rt_range = None
+    if not (is_blank(rt_min) and is_blank(rt_max)):
+        rt_range = (None if is_blank(rt_min) else float(rt_min), None if is_blank(rt_max) else float(rt_max))
+    return {
+        'rt_range': rt_range,
+        'frame_ranges': parse_frame_ranges(frame_ranges),
+        'msms_types': None if is_blank(msms_types) else parse_values(msms_types, lambda value: int(float(value))),
+    }
+
+def mobility_range_option(ko_min=None, ko_max=None, ccs_min=None, ccs_max=None, windows=()):
+    """Return the mobility_range (ko_min, ko_max) of extract_mobilograms for a 1/K0 or a CCS window.
+
+    CCS bounds are converted to 1/K0 with the charge and m/z of every (mzmin, mzmax, charge,
+    mz_value) window; the scans of all windows are read in one pass, so the union of their 1/K0
+    ranges is used. None or an empty string leaves an end open; returns None without any bound.
+
+    """
+    ko_bounds = [None if is_blank(value) else float(value) for value in (ko_min, ko_max)]
+    ccs_bounds = [None if is_blank(value) else float(value) for value in (ccs_min, ccs_max)]
+    if any(value is not None for value in ccs_bounds):
+        if any(value is not None for value in ko_bounds):
+            raise ValueError("Give either a 1/K0 or a CCS window, not both.")
+        if any(charge is None or mz_value is None for _, _, charge, mz_value in windows):
+            raise ValueError("A CCS window needs the charge and m/z of the ion.")
+        # 1/K0 is proportional to CCS for a given ion, so the bounds map to bounds
+        converted = [[None if ccs is None else ccsToOneOverK0ToCCSforMz(ccs, int(charge), float(mz_value)) for ccs in ccs_bounds]
+                     for _, _, charge, mz_value in windows]
+        ko_bounds = [None if ccs_bounds[0] is None else min(bounds[0] for bounds in converted),
+                     None if ccs_bounds[1] is None else max(bounds[1] for bounds in converted)]
+    if all(value is None for value in ko_bounds):
+        return None
+    return tuple(ko_bounds)
+
+def extract_folders(folder_paths, windows, use_recalibrated_state=True, pressure_compensation_strategy="AnalysisGlobalPressureCompensation", workers=1, on_folder_done=None, cache=None, folder_errors=None, **extraction_options):
+    """Run extract_folder_windows for every path, optionally in a pool of worker processes.
+
+    on_folder_done(done_count, folder_path) is called as each folder finishes, in completion order.
+    The returned list holds one list of per-window results per folder and is always in the order
+    of folder_paths. Results found in the optional ResultCache are not extracted again.
+    extraction_options are passed on to extract_folder_windows. A folder that fails gives None for
+    every window and is added to folder_errors (a dict of folder name to error message) if given.
+
+    """
+    results = [None] * len(folder_paths)
+
+    if workers <= 1 or len(folder_paths) <= 1:
+        # a single folder gets the workers for sharding its frames instead
+        for idx, folder_path in enumerate(folder_paths):
+            try:
+                results[idx] = extract_folder_windows(folder_path, windows, use_recalibrated_state=use_recalibrated_state, pressure_compensation_strategy=pressure_compensation_strategy, frame_workers=workers, cache=cache, **extraction_options)
+            except progress.Cancelled:
+                raise
+            except Exception as e:
+                record_folder_error(folder_errors, folder_path, e)
+                results[idx] = [None] * len(windows)
+            if on_folder_done:
+                on_folder_done(idx + 1, folder_path)
+        return results
+
+    # look up and store cache entries in this process so the hit/miss statistics end up here
+    done_count = 0
+    pending = {}
+    for idx, folder_path in enumerate(folder_paths):
+        keys, results[idx] = cached_results(cache, folder_path, windows, use_recalibrated_state, pressure_compensation_strategy, **extraction_options)
+        missing = [window_idx for window_idx, df in enumerate(results[idx]) if df is None]
+        if missing:
+            pending[idx] = (keys, missing)
+        else:
+            done_count += 1
+            if on_folder_done:
+                on_folder_done(done_count, folder_path)
+
+    if pending:
+        # each worker process opens its own TimsData handle
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending)), **progress.pool_options()) as executor:
+            futures = {
+                timing.submit(executor, extract_folder_windows, folder_paths[idx], [windows[window_idx] for window_idx in missing], use_recalibrated_state, pressure_compensation_strategy, **extraction_options): idx
+                for idx, (keys, missing) in pending.items()
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                keys, missing = pending[idx]
+                try:
+                    window_results = timing.result(future)
+                except progress.Cancelled:
+                    raise
+                except Exception as e:
+                    # the windows stay None and nothing is cached for them
+                    record_folder_error(folder_errors, folder_paths[idx], e)
+                    window_results = []
+                for window_idx, df in zip(missing, window_results):
+                    results[idx][window_idx] = df
+                    if cache is not None:
+                        cache.put(keys[window_idx], df)
+                done_count += 1
+                if on_folder_done:
+                    on_folder_done(done_count, folder_paths[idx])
+
+    return [[None if df is None or df.empty else df for df in folder_results] for folder_results in results]
+
+def assemble_matrix(ko_arrays, intensity_arrays):
+    """Place the (ko, intensity) results of several folders into one zero-filled matrix.
+
+    The rows are the sorted union of all ko values (the same rows the outer merge on ko used to
+    produce), the columns follow the order of the input lists. The matrix is allocated once and
+    every folder is placed with a single searchsorted, so assembly is linear in the folder count.
+    Returns (axis, matrix).
+
+    """
+    first = ko_arrays[0]
+    if all(len(ko) == len(first) and np.array_equal(ko, first) for ko in ko_arrays[1:]):
+        axis = np.asarray(first)
+    else:
+        axis = np.unique(np.concatenate(ko_arrays))
+
+    matrix = np.zeros((len(axis), len(ko_arrays)), dtype=np.result_type(*intensity_arrays))
+    for column, (ko, intensity) in enumerate(zip(ko_arrays, intensity_arrays)):
+        np.add.at(matrix[:, column], np.searchsorted(axis, ko), intensity)
+    return axis, matrix
+
+def window_output_base_path(input_folder, mzmin, mzmax):
+    """Output path of one m/z window without the extension of the output format."""
+    mz_range = f"_mz{int(mzmin)}-{int(mzmax)}"
+    return os.path.join(input_folder, f"{os.path.basename(input_folder)}{mz_range}_raw")
+
+def write_window_output(input_folder, jobs, window_results, mzmin, mzmax, sort_columns, ccs_conversion=False, charge=None, mz_value=None, output_format='csv'):
+    """Assemble the per-folder results of one m/z window into the *_raw.csv matrix (or another output_format).
+
+    jobs holds (folder_name, folder_path, column_name) in the order of window_results. Returns the
+    path of the written file, or None if no folder had data in the window.
+
+    """
+    columns = []
+    for (folder_name, full_folder_path, column_name), result_df in zip(jobs, window_results):
+        if result_df is not None:
+            columns.append((folder_name, column_name, result_df))
+        else:
+            print(f"Columns 'ko' and '{column_name}' not found in result_df.")
+
+    if not columns:
+        return None
+
+    if sort_columns:
+        columns.sort(key=lambda column: float(re.search(r'^(\d+(\.\d+)?)', column[1]).group(1)) if re.search(r'^(\d+(\.\d+)?)', column[1]) else float('inf'))
+
+    ko_arrays = []
+    for _, _, result_df in columns:
+        if ccs_conversion:
+            ko_arrays.append(oneOverK0ToCCSforMz(result_df['ko'].to_numpy(), charge, mz_value))
+        else:
+            ko_arrays.append(result_df['ko'].to_numpy())
+
+    with timing.stage('assemble'):
+        axis, matrix = assemble_matrix(ko_arrays, [result_df['intensity'].to_numpy() for _, _, result_df in columns])
+
+    # the CSV keeps m/z range, raw file names and voltages as header rows, binary formats as metadata
+    with timing.stage('write'):
+        output_file_path = write_matrix(window_output_base_path(input_folder, mzmin, mzmax), output_format, 'CCS' if ccs_conversion else 'Mobility', axis, matrix,
+                                        [column_name for _, column_name, _ in columns], [folder_name for folder_name, _, _ in columns], mzmin, mzmax)
+    print(f"Data saved to {output_file_path}")
+    return output_file_path
+
+def batch_row_parameters(row):
+    """Keyword arguments of extract_data for one row of a batch file (see extraction_template_v2.csv)."""
+    ccs_conversion = bool(row['Convert to CCS'])
+    return {
+        'input_folder': row['Parent Folder'],
+        # mzmin, mzmax, Charge and mz may hold ';'-separated lists for several windows
+        'mzmin': parse_values(row['mzmin']),
+        'mzmax': parse_values(row['mzmax']),
+        'extraction_method': row['Extraction Method'],
+        'sort_columns': bool(row['Sort Columns']),
+        'ccs_conversion': ccs_conversion,
+        'charge': parse_values(row['Charge'], int) if ccs_conversion else None,
+        'mz_value': parse_values(row['mz']) if ccs_conversion else None,
+        'use_recalibrated_state': bool(row.get('Use Recalibrated State', True)),
+        'pressure_compensation_strategy': row.get('Pressure Compensation Strategy', 'AnalysisGlobalPressureCompensation'),
+        'workers': int(get_row_value(row, 'Workers', 1)),
+        'mobility_bin_width': float(get_row_value(row, 'Mobility Bin Width', 0)),
+        'mobility_bin_count': int(get_row_value(row, 'Mobility Bin Count', 0)),
+        'output_format': str(get_row_value(row, 'Output Format', 'csv')).lower(),
+        # empty cells leave the frame selection open
+        'rt_min': get_row_value(row, 'RT Min'),
+        'rt_max': get_row_value(row, 'RT Max'),
+        'frame_ranges': get_row_value(row, 'Frame Ranges'),
+        'msms_types': get_row_value(row, 'MsMs Types'),
+        'ko_min': get_row_value(row, '1/K0 Min'),
+        'ko_max': get_row_value(row, '1/K0 Max'),
+        'ccs_min': get_row_value(row, 'CCS Min'),
+        'ccs_max': get_row_value(row, 'CCS Max'),
+    }
 
 # Defaults for use_recalibrated_state = True and pressure_compensation_strategy = AnalysisGlobalPressureCompensation for both single file and batch processing
-def process_data(input_folder, mzmin, mzmax, progress_var, status_var, process_button, root, extraction_method, sort_columns, ccs_conversion=False, charge=None, mz_value=None, use_recalibrated_state=True, pressure_compensation_strategy="AnalysisGlobalPressureCompensation"):
-    master_df = pd.DataFrame()
-    folder_names = {}
-    column_numbers = {}
+# mzmin, mzmax, charge and mz_value may be lists (or ';'-separated strings) to extract several windows in one pass
+def extract_data(input_folder, mzmin, mzmax, extraction_method, sort_columns, ccs_conversion=False, charge=None, mz_value=None, use_recalibrated_state=True, pressure_compensation_strategy="AnalysisGlobalPressureCompensation", workers=1, cache=None, mobility_bin_width=None, mobility_bin_count=None, output_format='csv', on_status=print, on_progress=None, use_manifest=True, timings=None, cancel_event=None, rt_min=None, rt_max=None, frame_ranges=None, msms_types=None, ko_min=None, ko_max=None, ccs_min=None, ccs_max=None, folder_errors=None):
+    """Extract all .d folders in input_folder and write one output file per m/z window.
+
+    Makes no GUI calls; on_status(message) and on_progress(fraction) report the progress. Returns
+    the paths of the output files, empty if no folder had data. With use_manifest, outputs whose
+    parameters and input folders are unchanged since they were written (see manifest.py) are
+    kept as they are, and only the other windows are extracted again. A stale window reads again
+    only the folders whose results are not in cache: without a cache (or with cache_size 0), or
+    once its entries were evicted, every folder of a stale window is extracted again. If timings is a
+    timing.StageTimings, the time per stage and folder is recorded there and the throughput is
+    added to the status messages. Setting cancel_event (a multiprocessing.Event) stops the
+    extraction at the next frame with progress.Cancelled; no output is written then.
+
+    rt_min and rt_max (seconds), frame_ranges (e.g. '1-500;800-900') and msms_types (e.g. 0 for
+    MS1 only, or '0;8') restrict the frames read from every folder; None keeps all frames.
+    ko_min and ko_max, or ccs_min and ccs_max, restrict the scans read from every frame to a
+    mobility window (see mobility_range_option).
+
+    A folder that cannot be extracted is left out of the outputs; if folder_errors is a dict, its
+    name is added there with the error message. Outputs missing a folder are not recorded in the
+    manifest, so they are written again by the next run.
+
+    """
+    # checked before any folder is read, not when the first output is written
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    if folder_errors is None:
+        folder_errors = {}
+    windows = mz_windows(mzmin, mzmax, charge, mz_value)
+    # output names keep only the integer part of the bounds; refuse to write one window over another
+    base_paths = [window_output_base_path(input_folder, window_mzmin, window_mzmax) for window_mzmin, window_mzmax, _, _ in windows]
+    duplicates = sorted(set(os.path.basename(base_path) for base_path in base_paths if base_paths.count(base_path) > 1))
+    if duplicates:
+        raise ValueError(f"Several m/z windows would be written to the same output ({', '.join(duplicates)}); "
+                         f"output names keep only the integer part of the m/z bounds.")
+    read_options = frame_selection_options(rt_min, rt_max, frame_ranges, msms_types)
+    read_options['mobility_range'] = mobility_range_option(ko_min, ko_max, ccs_min, ccs_max, windows)
 
     folder_list = [f for f in os.listdir(input_folder) if os.path.isdir(os.path.join(input_folder, f))]
     total_folders = len(folder_list)
 
-    for idx, folder_name in enumerate(folder_list):
+    jobs = []
+    for folder_name in folder_list:
         folder_path = os.path.join(input_folder, folder_name)
         full_folder_path = os.path.abspath(folder_path)
 
@@ -35,98 +307,145 @@ def process_data(input_folder, mzmin, mzmax, progress_var, status_var, process_b
         print(f"Extracted column name: {column_name}")
 
         if column_name:
-            status_message = f"Processing folder: {folder_name}"
-            process_data.update_status(status_message)
-            result_df = process_folder(full_folder_path, mzmin, mzmax, use_recalibrated_state=use_recalibrated_state, pressure_compensation_strategy=pressure_compensation_strategy)
+            jobs.append((folder_name, full_folder_path, column_name))
 
-            if result_df is not None:
-                if ccs_conversion:
-                    result_df['ko'] = result_df['ko'].apply(lambda x: oneOverK0ToCCSforMz(x, charge, mz_value))
+    def on_folder_done(done_count, folder_path):
+        message = f"Processed folder: {os.path.basename(folder_path)} ({done_count}/{len(jobs)})"
+        on_status(f"{message}, {timings.status()}" if timings is not None else message)
+        if on_progress:
+            on_progress(done_count / total_folders)
 
-                result_df.rename(columns={'intensity': column_name}, inplace=True)
+    manifest = load_manifest(input_folder) if use_manifest else {}
+    output_paths = []
+    entries = []
+    for base_path, (window_mzmin, window_mzmax, window_charge, window_mz_value) in zip(base_paths, windows):
+        output_paths.append(base_path + OUTPUT_FORMATS[output_format])
+        parameters = {
+            'mz_range': [window_mzmin, window_mzmax], 'charge': window_charge, 'mz': window_mz_value,
+            'extraction_method': extraction_method, 'sort_columns': sort_columns, 'ccs_conversion': ccs_conversion,
+            'use_recalibrated_state': use_recalibrated_state, 'pressure_compensation_strategy': pressure_compensation_strategy,
+            'mobility_bin_width': mobility_bin_width, 'mobility_bin_count': mobility_bin_count, 'output_format': output_format,
+            'backend': timsDataBackend(),
+        }
+        # like in the cache key, options left open keep existing entries valid
+        parameters.update({name: value for name, value in read_options.items() if value is not None})
+        entries.append(output_entry(jobs, parameters))
+    stale = [window_idx for window_idx in range(len(windows)) if not (use_manifest and is_up_to_date(manifest, output_paths[window_idx], entries[window_idx]))]
+    if len(stale) < len(windows):
+        on_status(f"{len(windows) - len(stale)} of {len(windows)} outputs are up to date")
+    if not stale:
+        if on_progress:
+            on_progress(1.0)
+        return output_paths
 
-                if master_df.empty:
-                    master_df = result_df[['ko', column_name]].copy()
-                else:
-                    master_df = pd.merge(master_df, result_df[['ko', column_name]], on='ko', how='outer')
-
-                folder_names[column_name] = folder_name
-                column_numbers[column_name] = column_name
-            else:
-                print(f"Columns 'ko' and '{column_name}' not found in result_df.")
+    mobility_edges = None
+    if jobs and (mobility_bin_width or mobility_bin_count):
+        # one grid for all folders, so that the output rows line up without a union axis; it spans
+        # the mobility ranges of all folders, and a folder that cannot be opened is left to fail
+        # (and be reported) in the extraction
+        ko_ranges = []
+        for _, full_folder_path, _ in jobs:
+            try:
+                ko_ranges.append(analysis_mobility_range(full_folder_path, use_recalibrated_state, pressure_compensation_strategy))
+            except Exception as e:
+                print(f"Error reading the mobility range of {full_folder_path}: {e}")
+        if ko_ranges:
+            mobility_edges = mobility_grid_edges(min(ko_range[0] for ko_range in ko_ranges), max(ko_range[1] for ko_range in ko_ranges),
+                                                 mobility_bin_width, mobility_bin_count)
 
-            progress_var.set((idx + 1) / total_folders * 100)
-            root.update_idletasks()
+    on_status(f"Processing {len(jobs)} folders")
+    with timing.activate(timings), progress.cancellable(cancel_event):
+        results = extract_folders([full_folder_path for _, full_folder_path, _ in jobs], [(windows[window_idx][0], windows[window_idx][1]) for window_idx in stale],
+                                  use_recalibrated_state=use_recalibrated_state,
+                                  pressure_compensation_strategy=pressure_compensation_strategy,
+                                  workers=workers, on_folder_done=on_folder_done, cache=cache,
+                                  folder_errors=folder_errors, mobility_edges=mobility_edges, **read_options)
 
-    if master_df.empty:
-        messagebox.showerror("Error", "No data to process.")
-        status_var.set("Error: No data to process.")
-        root.update_idletasks()
-        return
+    written = {}
+    recorded = {}
+    removed = []
+    for result_idx, window_idx in enumerate(stale):
+        window_mzmin, window_mzmax, window_charge, window_mz_value = windows[window_idx]
+        with timing.activate(timings):
+            output_file_path = write_window_output(input_folder, jobs, [folder_results[result_idx] for folder_results in results],
+                                                   window_mzmin, window_mzmax, sort_columns, ccs_conversion, window_charge, window_mz_value, output_format)
+        written[window_idx] = output_file_path
+        if output_file_path is not None and not folder_errors:
+            record_output(recorded, output_file_path, entries[window_idx])
+        else:
+            removed.append(os.path.basename(output_paths[window_idx]))
+    if use_manifest:
+        update_manifest(input_folder, recorded, removed)
 
-    master_df.fillna(0, inplace=True)
+    output_files = [written.get(window_idx, output_paths[window_idx]) for window_idx in range(len(windows))]
+    return [output_file_path for output_file_path in output_files if output_file_path is not None]
 
-    if sort_columns:
-        column_order = ['ko'] + sorted(
-            [col for col in master_df.columns if col != 'ko'],
-            key=lambda x: float(re.search(r'^(\d+(\.\d+)?)', x).group(1)) if re.search(r'^(\d+(\.\d+)?)', x) else float('inf')
-        )
-        master_df = master_df[column_order]
-
-    if ccs_conversion:
-        master_df.rename(columns={'ko': 'CCS'}, inplace=True)
-    else:
-        master_df.rename(columns={'ko': 'Mobility'}, inplace=True)
+def process_data(input_folder, mzmin, mzmax, channel, extraction_method, sort_columns, ccs_conversion=False, charge=None, mz_value=None, use_recalibrated_state=True, pressure_compensation_strategy="AnalysisGlobalPressureCompensation", workers=1, cache=None, mobility_bin_width=None, mobility_bin_count=None, output_format='csv', rt_min=None, rt_max=None, frame_ranges=None, msms_types=None, ko_min=None, ko_max=None, ccs_min=None, ccs_max=None):
+    """Run extract_data from the UI thread's worker, reporting through a progress.ProgressChannel.
 
-    # Prepare header rows
-    mz_range = f"_mz{int(mzmin)}-{int(mzmax)}"
-    output_file_name = f"{os.path.basename(input_folder)}{mz_range}_raw.csv"
-    output_file_path = os.path.join(input_folder, output_file_name)
+    Makes no Tk calls; the UI drains the channel. Returns True if output was written. Raises
+    progress.Cancelled if the channel was cancelled.
 
-    mzmin_max_row = ['#mz range'] + [f'{mzmin}-{mzmax}'] * (len(master_df.columns) - 1)
-    folder_row = ['#Raw file name'] + [folder_names[col] for col in master_df.columns if col != 'Mobility' and col != 'CCS']
-    number_row = ['Mobility' if not ccs_conversion else 'CCS'] + [column_numbers[col] for col in master_df.columns if col != 'Mobility' and col != 'CCS']
+    """
+    # the timings add the frame and peak throughput to the status line
+    timings = timing.StageTimings()
+    folder_errors = {}
+    output_files = extract_data(input_folder, mzmin, mzmax, extraction_method, sort_columns, ccs_conversion, charge, mz_value,
+                                use_recalibrated_state, pressure_compensation_strategy, workers, cache, mobility_bin_width, mobility_bin_count,
+                                output_format, on_status=channel.status, on_progress=channel.progress, timings=timings,
+                                cancel_event=channel.cancel_event, rt_min=rt_min, rt_max=rt_max, frame_ranges=frame_ranges, msms_types=msms_types,
+                                ko_min=ko_min, ko_max=ko_max, ccs_min=ccs_min, ccs_max=ccs_max, folder_errors=folder_errors)
 
-    # Create DataFrame for the additional rows and concatenate
-    additional_rows = pd.DataFrame([mzmin_max_row, folder_row, number_row], columns=master_df.columns)
-    final_df = pd.concat([additional_rows, master_df], ignore_index=True)
+    if folder_errors:
+        channel.error(f"{len(folder_errors)} folders could not be processed:\n" + "\n".join(f"{folder_name}: {message}" for folder_name, message in folder_errors.items()))
 
-    final_df.to_csv(output_file_path, index=False, header=False)
-    print(f"Data saved to {output_file_path}")
+    if not output_files:
+        channel.error("No data to process.")
+        channel.status("Error: No data to process.")
+        return False
 
-    status_var.set("Processing complete")
-    root.update_idletasks()
-    process_button.config(text="Select folder containing .d files", state="normal")
+    if cache is not None:
+        stats = cache.stats()
+        channel.status(f"Processing complete, {timings.status()} (cache: {stats['hits']} hits, {stats['misses']} misses)")
+    else:
+        channel.status(f"Processing complete, {timings.status()}")
+    return True
 
+def process_single_data(channel, **parameters):
+    """Thread target of a single extraction (see process_data); always ends the channel with done()."""
+    try:
+        process_data(channel=channel, **parameters)
+    except progress.Cancelled:
+        channel.status("Processing cancelled")
+    except Exception as e:
+        channel.error(f"Processing failed: {e}")
+        channel.status(f"Error: {e}")
+    finally:
+        channel.done()
 
-def process_batch_data(batch_data, progress_var, status_var, batch_button, root):
+def process_batch_data(batch_data, channel, cache=None):
+    """Thread target of a batch extraction; stops after the current frame when the channel is cancelled."""
     total_folders = len(batch_data)
-    
-    for idx, row in batch_data.iterrows():
-        try:
-            input_folder = row['Parent Folder']
-            mzmin = float(row['mzmin'])
-            mzmax = float(row['mzmax'])
-            extraction_method = row['Extraction Method']
-            sort_columns = bool(row['Sort Columns'])
-            ccs_conversion = bool(row['Convert to CCS'])
-            charge = int(row['Charge']) if ccs_conversion else None
-            mz_value = float(row['mz']) if ccs_conversion else None
-            use_recalibrated_state = bool(row.get('Use Recalibrated State', True))
-            pressure_compensation_strategy = row.get('Pressure Compensation Strategy', 'AnalysisGlobalPressureCompensation')
-            
-            status_var.set(f"Processing folder {input_folder} ({idx + 1}/{total_folders})")
-            root.update_idletasks()
-
-            process_data(input_folder, mzmin, mzmax, progress_var, status_var, batch_button, root, extraction_method, sort_columns, ccs_conversion, charge, mz_value, use_recalibrated_state, pressure_compensation_strategy)
-
-        except Exception as e:
-            status_var.set(f"Error processing folder {input_folder}: {e}")
-            root.update_idletasks()
-
-        progress_var.set((idx + 1) / total_folders * 100)
-        root.update_idletasks()
-
-    status_var.set("Batch processing complete")
-    batch_button.config(text="Batch Extraction", state="normal")
-    root.update_idletasks()
+    try:
+        for idx, row in batch_data.iterrows():
+            input_folder = row.get('Parent Folder')
+            try:
+                parameters = batch_row_parameters(row)
+                channel.status(f"Processing folder {input_folder} ({idx + 1}/{total_folders})")
+                process_data(channel=channel, cache=cache, **parameters)
+
+            except progress.Cancelled:
+                channel.status(f"Batch processing cancelled at folder {input_folder} ({idx + 1}/{total_folders})")
+                return
+            except Exception as e:
+                channel.status(f"Error processing folder {input_folder}: {e}")
+
+            channel.progress((idx + 1) / total_folders)
+
+        if cache is not None:
+            stats = cache.stats()
+            channel.status(f"Batch processing complete (cache: {stats['hits']} hits, {stats['misses']} misses)")
+        else:
+            channel.status("Batch processing complete")
+    finally:
+        channel.done()
@@ -0,0 +1,108 @@
+"""Progress events from the extraction thread to the UI, and cancellation of a running extraction"""
+import queue
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+class Cancelled(Exception):
+    """Raised between two frames when the running extraction was cancelled."""
+
+# event checked by check_cancelled(), kept per thread so that extractions running in different
+# threads each see their own; installed in worker processes by pool_options()
+_local = threading.local()
+
+def cancel_event():
+    return getattr(_local, 'cancel_event', None)
+
+def install_cancel_event(event):
+    _local.cancel_event = event
+
+@contextmanager
+def cancellable(event):
+    """Make check_cancelled() raise Cancelled within the block (in this thread) once event is set (None disables it)."""
+    previous = cancel_event()
+    install_cancel_event(event)
+    try:
+        yield
+    finally:
+        install_cancel_event(previous)
+
+def check_cancelled():
+    event = cancel_event()
+    if event is not None and event.is_set():
+        raise Cancelled("Extraction cancelled.")
+
+def pool_options():
+    """Keyword arguments for ProcessPoolExecutor that pass the cancel event on to the worker processes.
+
+    A multiprocessing event can only reach another process when the process is started, so it
+    goes through the pool initializer rather than with every submitted call. The initializer runs
+    in the thread that executes the submitted calls.
+
+    """
+    event = cancel_event()
+    if event is None:
+        return {}
+    return {'initializer': install_cancel_event, 'initargs': (event,)}
+
+class ProgressChannel:
+    """Queue of progress events pushed by the extraction thread and drained by the Tk main loop.
+
+    status(), progress(), error() and done() may be called from any thread; only drain() touches
+    Tk. cancel() sets cancel_event, which stops the extraction at the next frame (see
+    check_cancelled).
+
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self.cancel_event = multiprocessing.Event()
+
+    def status(self, message):
+        self.events.put(('status', message))
+
+    def progress(self, fraction):
+        self.events.put(('progress', fraction))
+
+    def error(self, message):
+        self.events.put(('error', message))
+
+    def done(self):
+        self.events.put(('done', None))
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def drain(self, root, on_status, on_progress, on_error, on_done, interval_ms=100):
+        """Apply the queued events every interval_ms until done.
+
+        Of the events queued since the last drain only the latest status and progress are shown,
+        so a fast extraction does not flood the UI with updates.
+
+        """
+        status = fraction = None
+        finished = False
+        while True:
+            try:
+                kind, value = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'status':
+                status = value
+            elif kind == 'progress':
+                fraction = value
+            elif kind == 'error':
+                on_error(value)
+            elif kind == 'done':
+                finished = True
+        if fraction is not None:
+            on_progress(fraction)
+        if status is not None:
+            on_status(status)
+        if finished:
+            on_done()
+        else:
+            root.after(interval_ms, self.drain, root, on_status, on_progress, on_error, on_done, interval_ms)
@@ -0,0 +1,124 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.tdfextract', 'cache')
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+def acquisition_fingerprint(d_folder_path):
+    """Return [size, mtime_ns] of analysis.tdf and analysis.tdf_bin (None for missing files)."""
+    fingerprint = {}
+    for file_name in ('analysis.tdf', 'analysis.tdf_bin'):
+        try:
+            st = os.stat(os.path.join(d_folder_path, file_name))
+            fingerprint[file_name] = [st.st_size, st.st_mtime_ns]
+        except FileNotFoundError:
+            fingerprint[file_name] = None
+    return fingerprint
+
+def cache_key(d_folder_path, **parameters):
+    """Key for the result of extracting d_folder_path with the given extraction parameters.
+
+    The key changes whenever the raw data files are rewritten or any parameter differs.
+
+    """
+    description = {
+        'path': os.path.normcase(os.path.abspath(d_folder_path)),
+        'files': acquisition_fingerprint(d_folder_path),
+        'parameters': parameters,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=_json_value).encode('utf-8')).hexdigest()
+
+def _json_value(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+class ResultCache:
+    """Extracted mobilograms stored as .npz files, evicted least recently used first.
+
+    The modification time of an entry is its last use; the total size of all entries is kept
+    below max_bytes.
+
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """Return the cached DataFrame (ko, intensity) for key (empty if there was no data), or None on a miss."""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                df = pd.DataFrame({name: data[name] for name in data.files})
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return df
+
+    def put(self, key, df):
+        """Store df under key; None is stored as an empty result so that it is not extracted again."""
+        if df is None:
+            df = pd.DataFrame({'ko': np.empty(0, dtype=np.float64), 'intensity': np.empty(0, dtype=np.uint64)})
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # write to a private file first so concurrent readers never see a partial entry
+            tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **{column: df[column].to_numpy() for column in df.columns})
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Error writing result cache entry: {e}")
+            return
+        self.evict()
+
+    def entries(self):
+        """Return (mtime, size, path) of all cache entries, oldest first."""
+        result = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return result
+        for name in names:
+            if name.endswith('.npz'):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                result.append((st.st_mtime_ns, st.st_size, path))
+        return sorted(result)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+        }
@@ -0,0 +1,172 @@
+"""Per-stage timings of the extraction pipeline.
+
+Timings are only recorded while a StageTimings is active in the calling thread (see activate);
+otherwise record() and stage() cost one clock read. Work submitted to worker processes with
+submit() is timed there and merged back by result().
+"""
+import time
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# the StageTimings of every thread, so that extractions running in parallel threads do not mix
+_local = threading.local()
+
+def traced_peak_mb():
+    """Peak memory traced since the previous call in MB, or None if tracemalloc is not tracing.
+
+    Resets the peak, so that every recorded stage gets the peak reached since the stage recorded
+    before it. tracemalloc sees the memory allocated by Python and NumPy, not allocations made
+    inside timsdata.dll.
+
+    """
+    if not tracemalloc.is_tracing():
+        return None
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    return peak / (1024 * 1024)
+
+class StageTimings:
+    """Wall time, calls, frames, peaks and peak memory per stage, in total and per .d folder.
+
+    Peak memory is only measured with track_memory, which runs tracemalloc while the timings are
+    active and slows down the extraction somewhat.
+
+    """
+
+    def __init__(self, track_memory=False):
+        self.started = time.perf_counter()
+        self.track_memory = track_memory
+        self.stages = {}
+        self.folders = {}
+
+    def add(self, name, seconds, calls=1, frames=0, peaks=0, peak_memory=None):
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'frames': 0, 'peaks': 0, 'peak_memory_mb': None})
+        stage['seconds'] += seconds
+        stage['calls'] += calls
+        stage['frames'] += frames
+        stage['peaks'] += peaks
+        if peak_memory is not None:
+            stage['peak_memory_mb'] = max(stage['peak_memory_mb'] or 0.0, peak_memory)
+
+    def merge(self, other):
+        for name, stage in other.stages.items():
+            self.add(name, stage['seconds'], stage['calls'], stage['frames'], stage['peaks'], stage['peak_memory_mb'])
+        for folder_name, folder_timings in other.folders.items():
+            self.folders.setdefault(folder_name, StageTimings()).merge(folder_timings)
+
+    def totals(self):
+        """The stages summed over this object and all folders."""
+        totals = StageTimings()
+        totals.merge(self)
+        for folder_timings in self.folders.values():
+            totals.merge(folder_timings)
+        totals.folders = {}
+        return totals.stages
+
+    def throughput(self):
+        """(frames/s, peaks/s) of the frames read so far, over the wall time since creation."""
+        read = self.totals().get('read', {'frames': 0, 'peaks': 0})
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return read['frames'] / elapsed, read['peaks'] / elapsed
+
+    def status(self):
+        frames_per_second, peaks_per_second = self.throughput()
+        return f"{frames_per_second:,.0f} frames/s, {peaks_per_second:,.0f} peaks/s"
+
+    def to_dict(self):
+        """JSON-ready summary; stage times of worker processes add up, so they can exceed 'seconds'."""
+        return {
+            'seconds': time.perf_counter() - self.started,
+            'stages': self.totals(),
+            'folders': {folder_name: folder_timings.totals() for folder_name, folder_timings in self.folders.items()},
+        }
+
+def active():
+    return getattr(_local, 'timings', None)
+
+@contextmanager
+def activate(timings):
+    """Record into timings (None disables recording) within the block, in this thread."""
+    previous = active()
+    _local.timings = timings
+    start_tracing = timings is not None and timings.track_memory and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    try:
+        yield timings
+    finally:
+        if start_tracing:
+            tracemalloc.stop()
+        _local.timings = previous
+
+def record(name, start, calls=1, frames=0, peaks=0):
+    """Add the time since start (a time.perf_counter() value) to stage name of the active timings."""
+    timings = active()
+    if timings is not None:
+        timings.add(name, time.perf_counter() - start, calls, frames, peaks, traced_peak_mb())
+
+@contextmanager
+def stage(name):
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, start)
+
+@contextmanager
+def folder(folder_name):
+    """Record the stages within the block for one .d folder."""
+    parent = active()
+    if parent is None:
+        yield
+        return
+    with activate(StageTimings()) as folder_timings:
+        try:
+            yield
+        finally:
+            parent.folders.setdefault(folder_name, StageTimings()).merge(folder_timings)
+
+def call_with_timings(track_memory, function, *args, **kwargs):
+    """Run function with its own active StageTimings; returns (result, timings)."""
+    with activate(StageTimings(track_memory)) as timings:
+        return function(*args, **kwargs), timings
+
+def submit(executor, function, *args, **kwargs):
+    """executor.submit that times the call in the worker process if timings are active here."""
+    timings = active()
+    if timings is None:
+        return executor.submit(function, *args, **kwargs)
+    future = executor.submit(call_with_timings, timings.track_memory, function, *args, **kwargs)
+    future.timings = timings
+    return future
+
+def result(future):
+    """The result of a future from submit(), merging its timings into the timings active at submit time."""
+    timings = getattr(future, 'timings', None)
+    if timings is None:
+        return future.result()
+    value, worker_timings = future.result()
+    timings.merge(worker_timings)
+    return value
+
+@contextmanager
+def profiled(output_path=None):
+    """Run the block under cProfile and dump the statistics to output_path (no-op without a path).
+
+    Only this process is profiled; worker processes show up as time spent waiting.
+
+    """
+    if not output_path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output_path)
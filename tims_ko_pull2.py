@@ -1,81 +1,865 @@
 import sys
 import os
+import copy
+import json
+import time
 import argparse
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 from timsdata import *
+import timing
+import progress
 
 if getattr(sys, 'frozen', False):
     bundle_dir = sys._MEIPASS
     dll_path = os.path.join(bundle_dir, 'timsdata.dll')
-    os.add_dll_directory(os.path.dirname(dll_path))
+    if hasattr(os, 'add_dll_directory'):  # Windows only
+        os.add_dll_directory(os.path.dirname(dll_path))
 else:
-    os.add_dll_directory(os.getcwd())
+    if hasattr(os, 'add_dll_directory'):  # Windows only
+        os.add_dll_directory(os.getcwd())
     dll_path = os.path.join(os.getcwd(), 'timsdata.dll')
 
+def mz_window_to_index_bounds(td, frame_id, mzmins, mzmaxs):
+    """Convert the m/z windows [mzmins[i], mzmaxs[i]] to inclusive ranges of TOF indices.
+
+    Needs a single mzToIndex call for all windows; the indices next to every bound are converted
+    back with one indexToMz call so that boundary peaks are selected exactly as by the m/z-based
+    filter. Returns the arrays (lo, hi).
+
+    """
+    mzmins = np.asarray(mzmins, dtype=np.float64)
+    mzmaxs = np.asarray(mzmaxs, dtype=np.float64)
+    index_bounds = td.mzToIndex(frame_id, np.concatenate([mzmins, mzmaxs]))
+    lo = np.maximum(np.ceil(index_bounds[:len(mzmins)]).astype(np.int64), 1)
+    hi = np.maximum(np.floor(index_bounds[len(mzmins):]).astype(np.int64), lo - 1)
+
+    mz_lo_prev, mz_lo, mz_hi, mz_hi_next = td.indexToMz(frame_id, np.concatenate([lo - 1, lo, hi, hi + 1])).reshape(4, -1)
+    lo = np.where(mz_lo_prev >= mzmins, lo - 1, np.where(mz_lo < mzmins, lo + 1, lo))
+    hi = np.where(mz_hi_next <= mzmaxs, hi + 1, np.where(mz_hi > mzmaxs, hi - 1, hi))
+    return lo, hi
+
+def mz_window_selector(td, frame_id, windows, filter_mode='index'):
+    """Prepare the peak selection of one frame for a list of (mzmin, mzmax) windows.
+
+    Returns (peak_values, lower, upper): peak_values maps a TOF index array to the values that
+    are compared against the half-open per-window bounds [lower, upper). filter_mode 'index'
+    compares the raw uint32 indices against bounds computed once for the frame, 'mz' converts
+    every index with indexToMz first.
+
+    """
+    mzmins = np.array([window[0] for window in windows], dtype=np.float64)
+    mzmaxs = np.array([window[1] for window in windows], dtype=np.float64)
+    if filter_mode == 'index':
+        lo, hi = mz_window_to_index_bounds(td, frame_id, mzmins, mzmaxs)
+        return (lambda indices: indices), lo, hi + 1
+    if filter_mode == 'mz':
+        # mz <= mzmax  <=>  mz < next float after mzmax
+        return (lambda indices: td.indexToMz(frame_id, indices)), mzmins, np.nextafter(mzmaxs, np.inf)
+    raise ValueError(f"Unknown filter mode: {filter_mode}")
+
+def sum_frame_intensities(offsets, indices, intensities, peak_values, lower, upper):
+    """Sum the intensities of one frame (as returned by TimsData.readScansArrays) per window and scan.
+
+    Returns a uint64 array of shape (num_windows, num_scans). Non-overlapping windows are
+    resolved for all peaks at once with a single searchsorted over the sorted window bounds.
+
+    """
+    num_scans = len(offsets) - 1
+    scan_numbers = np.repeat(np.arange(num_scans), np.diff(offsets))
+    values = peak_values(indices)
+    num_windows = len(lower)
+
+    order = np.argsort(lower, kind='stable')
+    edges = np.column_stack([lower[order], upper[order]]).ravel()
+    if np.all(np.diff(edges) >= 0):
+        # a peak lies inside a window iff an odd number of edges is <= its value
+        position = np.searchsorted(edges, values, side='right')
+        inside = (position & 1) == 1
+        window_numbers = order[(position[inside] - 1) // 2]
+        sums = np.bincount(window_numbers * num_scans + scan_numbers[inside], weights=intensities[inside], minlength=num_windows * num_scans)
+    else:
+        sums = np.concatenate([
+            np.bincount(scan_numbers[mask], weights=intensities[mask], minlength=num_scans)
+            for mask in ((values >= lo) & (values < hi) for lo, hi in zip(lower, upper))
+        ])
+    return sums.reshape(num_windows, num_scans).astype(np.uint64)
+
+class MobilogramAccumulator:
+    """Per-window, per-scan intensity sums, kept separately for every distinct 1/K0 axis seen."""
+
+    def __init__(self, num_windows=1):
+        self.num_windows = num_windows
+        self.axes = []
+        self.sums = []
+        # position in axes/sums by the bytes of the axis, so that an axis is found in constant time
+        # even with per-frame pressure compensation, where nearly every frame has its own axis
+        self.positions = {}
+
+    def add(self, ko_axis, scan_sums):
+        ko_axis = np.asarray(ko_axis, dtype=np.float64)
+        key = ko_axis.tobytes()
+        position = self.positions.get(key)
+        if position is not None:
+            self.sums[position] += scan_sums
+            return
+        self.positions[key] = len(self.axes)
+        self.axes.append(ko_axis.copy())
+        self.sums.append(np.array(scan_sums, dtype=np.uint64).reshape(self.num_windows, len(ko_axis)))
+
+    def empty(self):
+        """A new accumulator for the same windows without any sums."""
+        return MobilogramAccumulator(self.num_windows)
+
+    def merge(self, other):
+        """Add the partial sums of another accumulator (e.g. from a different frame shard)."""
+        for axis, sums in zip(other.axes, other.sums):
+            self.add(axis, sums)
+
+    def to_frames(self):
+        """Return one summed mobilogram per window as a DataFrame (ko, intensity) sorted by ko, or None if empty."""
+        if not self.axes:
+            return [None] * self.num_windows
+        ko = np.concatenate(self.axes)
+        window_sums = np.concatenate(self.sums, axis=1)
+        frames = []
+        for sums in window_sums:
+            non_empty = sums > 0
+            if not non_empty.any():
+                frames.append(None)
+                continue
+            ko_values, inverse = np.unique(ko[non_empty], return_inverse=True)
+            intensity = np.zeros(len(ko_values), dtype=np.uint64)
+            np.add.at(intensity, inverse, sums[non_empty])
+            frames.append(pd.DataFrame({'ko': ko_values, 'intensity': intensity}))
+        return frames
+
+    def to_frame(self):
+        """Return the summed mobilogram of the first window (see to_frames)."""
+        return self.to_frames()[0]
+
+def mobility_bin_numbers(edges, ko_axis):
+    """Return (bins, valid): the bin [edges[i], edges[i + 1]) of every 1/K0 value and whether it is on the grid.
+
+    The last bin includes its right edge.
+
+    """
+    num_bins = len(edges) - 1
+    bins = np.searchsorted(edges, ko_axis, side='right') - 1
+    bins[ko_axis == edges[-1]] = num_bins - 1
+    return bins, (bins >= 0) & (bins < num_bins)
+
+class MobilityHistogram:
+    """Per-window intensities binned on a fixed 1/K0 grid given by its bin edges.
+
+    Used instead of MobilogramAccumulator when every frame has its own mobility axis (per-frame
+    pressure compensation): memory and output size depend on the grid only, not on the number of
+    frames. Scans outside the grid are dropped.
+
+    """
+
+    def __init__(self, edges, num_windows=1):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.num_windows = num_windows
+        self.sums = np.zeros((num_windows, len(self.edges) - 1), dtype=np.uint64)
+
+    def add(self, ko_axis, scan_sums):
+        num_bins = len(self.edges) - 1
+        bins, valid = mobility_bin_numbers(self.edges, ko_axis)
+        keys = (np.arange(self.num_windows)[:, None] * num_bins + bins[valid]).ravel()
+        weights = np.asarray(scan_sums).reshape(self.num_windows, len(ko_axis))[:, valid].ravel()
+        binned = np.bincount(keys, weights=weights, minlength=self.num_windows * num_bins)
+        self.sums += binned.reshape(self.num_windows, num_bins).astype(np.uint64)
+
+    def empty(self):
+        return MobilityHistogram(self.edges, self.num_windows)
+
+    def merge(self, other):
+        self.sums += other.sums
+
+    def to_frames(self):
+        """Return one DataFrame (ko = bin center, intensity) per window covering the whole grid, or None if empty."""
+        centers = (self.edges[:-1] + self.edges[1:]) / 2
+        return [pd.DataFrame({'ko': centers, 'intensity': sums.copy()}) if sums.any() else None for sums in self.sums]
+
+    def to_frame(self):
+        return self.to_frames()[0]
+
+def mobility_grid_edges(ko_min, ko_max, bin_width=None, bin_count=None):
+    """Bin edges of a uniform 1/K0 grid over [ko_min, ko_max], given either a bin width or a bin count."""
+    if bin_width:
+        bin_count = max(int(np.ceil((ko_max - ko_min) / bin_width)), 1)
+        return ko_min + np.arange(bin_count + 1) * bin_width
+    if bin_count:
+        return np.linspace(ko_min, ko_max, int(bin_count) + 1)
+    raise ValueError("Either a mobility bin width or a bin count is required.")
+
+# Map the UI strings (and the enum names used in batch files) to the actual strategy
+strategy_mapping = {
+    "No compensation": PressureCompensationStrategy.NoPressureCompensation,
+    "Per-frame": PressureCompensationStrategy.PerFramePressureCompensation,
+    "Global": PressureCompensationStrategy.AnalyisGlobalPressureCompensation,
+    "AnalysisGlobalPressureCompensation": PressureCompensationStrategy.AnalyisGlobalPressureCompensation,
+}
+strategy_mapping.update({strategy.name: strategy for strategy in PressureCompensationStrategy})
+
+def resolve_pressure_compensation_strategy(strategy):
+    if isinstance(strategy, PressureCompensationStrategy):
+        return strategy
+    if strategy not in strategy_mapping:
+        raise ValueError(f"Unknown pressure compensation strategy: {strategy}")
+    return strategy_mapping[strategy]
+
+def count_frames(input_folder):
+    conn = connectAnalysisTdf(input_folder)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM Frames").fetchone()[0]
+    finally:
+        conn.close()
+
+def frames_mobility_range(td, margin=0.01):
+    """Return (ko_min, ko_max) covered by the scans of an open analysis, widened by margin times the span.
+
+    The axis ends are taken from the first and the last frame; the margin absorbs the drift of
+    per-frame pressure compensation in between.
+
+    """
+    frames = td.frames
+    if len(frames) == 0:
+        raise ValueError("The analysis contains no frames.")
+    scan_ends = [0, int(frames['NumScans'].max()) - 1]
+    ko_ends = np.concatenate([td.scanNumToOneOverK0(int(frame_id), scan_ends) for frame_id in (frames['Id'][0], frames['Id'][-1])])
+    ko_min, ko_max = float(ko_ends.min()), float(ko_ends.max())
+    span = ko_max - ko_min
+    return ko_min - margin * span, ko_max + margin * span
+
+def parse_frame_ranges(value):
+    """Parse frame ranges like '1-500;800-900;1200' into a list of inclusive (first, last) frame ids.
+
+    Lists of pairs (or single ids) are accepted as well; None or an empty string selects nothing
+    and returns None.
+
+    """
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, str):
+        parts = [part.strip() for part in value.split(';') if part.strip()]
+    else:
+        parts = list(value)
+    frame_ranges = []
+    for part in parts:
+        if isinstance(part, str):
+            first, _, last = part.partition('-')
+            part = (first, last or first)
+        elif not isinstance(part, (list, tuple)):
+            part = (part, part)
+        first, last = int(part[0]), int(part[1])
+        if last < first:
+            raise ValueError(f"Invalid frame range {first}-{last}.")
+        frame_ranges.append((first, last))
+    return frame_ranges
+
+def select_frames(frames, rt_range=None, frame_ranges=None, msms_types=None):
+    """Return the Ids of the rows of a Frames array that pass all given filters.
+
+    rt_range is (rt_min, rt_max) in seconds of Frames.Time with None for an open end,
+    frame_ranges a list of inclusive (first, last) frame ids and msms_types a list of
+    Frames.MsMsType values (0 selects the MS1 frames).
+
+    """
+    keep = np.ones(len(frames), dtype=bool)
+    if rt_range is not None:
+        rt_min, rt_max = rt_range
+        if rt_min is not None:
+            keep &= frames['Time'] >= rt_min
+        if rt_max is not None:
+            keep &= frames['Time'] <= rt_max
+    if frame_ranges:
+        in_range = np.zeros(len(frames), dtype=bool)
+        for first, last in frame_ranges:
+            in_range |= (frames['Id'] >= first) & (frames['Id'] <= last)
+        keep &= in_range
+    if msms_types is not None:
+        keep &= np.isin(frames['MsMsType'], msms_types)
+    return frames['Id'][keep]
+
+def has_frame_selection(rt_range=None, frame_ranges=None, msms_types=None):
+    return rt_range is not None or bool(frame_ranges) or msms_types is not None
+
+def selected_frame_ids(input_folder, rt_range=None, frame_ranges=None, msms_types=None):
+    """Ids of the frames selected by select_frames, read from the Frames table without opening the raw data."""
+    conn = connectAnalysisTdf(input_folder)
+    try:
+        rows = conn.execute("SELECT Id, Time, IFNULL(MsMsType, 0) FROM Frames ORDER BY Id").fetchall()
+    finally:
+        conn.close()
+    frames = np.array(rows, dtype=[('Id', np.int64), ('Time', np.float64), ('MsMsType', np.int32)])
+    return select_frames(frames, rt_range, frame_ranges, msms_types)
+
+def analysis_mobility_range(input_folder, use_recalibrated_state=True, pressure_compensation_strategy="Global", margin=0.01):
+    """Return (ko_min, ko_max) covered by the scans of an analysis (see frames_mobility_range)."""
+    strategy = resolve_pressure_compensation_strategy(pressure_compensation_strategy)
+    with openTimsData(os.path.normpath(input_folder), use_recalibrated_state=use_recalibrated_state, pressure_compensation_strategy=strategy) as td:
+        if len(td.frames) == 0:
+            raise ValueError(f"The analysis {input_folder} contains no frames.")
+        return frames_mobility_range(td, margin)
+
+def shares_mobility_axis(strategy, frames):
+    """True if all rows of a Frames array have the same mobility axis.
+
+    That is the case with global pressure compensation for frames of a single TIMS calibration;
+    otherwise every frame has to be converted with its own axis.
+
+    """
+    if strategy != PressureCompensationStrategy.AnalyisGlobalPressureCompensation or len(frames) == 0:
+        return False
+    return 'TimsCalibration' in frames.dtype.names and len(np.unique(frames['TimsCalibration'])) == 1
+
+def mobility_scan_ranges(td, frame_ids, mobility_range, shared_axis=False):
+    """Return the (scan_begin, scan_end) of every frame covering the 1/K0 range (ko_min, ko_max).
+
+    Either end may be None. The bounds are converted with oneOverK0ToScanNum and rounded
+    outwards, so the range may hold a scan just outside the mobility range at either end. With
+    shared_axis all frames have the mobility axis of the first frame and one conversion is enough.
+
+    """
+    ko_min, ko_max = mobility_range
+    frame_ids = np.asarray(frame_ids, dtype=np.int64)
+    converted = frame_ids[:1] if shared_axis else frame_ids
+    scan_ranges = np.zeros((len(converted), 2), dtype=np.int64)
+    scan_ranges[:, 1] = np.iinfo(np.int32).max  # clipped to the scans of each frame by iter_frames
+    # 1/K0 decreases with the scan number: ko_max bounds the first scan, ko_min the last
+    for row, frame_id in enumerate(converted.tolist()):
+        if ko_max is not None:
+            scan_ranges[row, 0] = max(int(np.floor(td.oneOverK0ToScanNum(frame_id, [ko_max])[0])), 0)
+        if ko_min is not None:
+            scan_ranges[row, 1] = max(int(np.ceil(td.oneOverK0ToScanNum(frame_id, [ko_min])[0])) + 1, 0)
+    return np.repeat(scan_ranges, len(frame_ids), axis=0) if shared_axis else scan_ranges
+
+def accumulate_frames(td, frame_ids, windows, filter_mode, accumulator, shared_sums=None, mobility_range=None):
+    """Add the per-scan intensity sums of the given frames to accumulator.
+
+    If shared_sums (windows x scans) is given, all frames share one mobility axis and are summed
+    there by scan number instead; the array is grown if a frame has more scans and returned.
+    mobility_range (ko_min, ko_max) restricts the scans read from every frame to that 1/K0 range.
+
+    """
+    scan_ranges = None
+    if mobility_range is not None:
+        scan_ranges = mobility_scan_ranges(td, frame_ids, mobility_range, shared_axis=shared_sums is not None)
+        ko_min = -np.inf if mobility_range[0] is None else mobility_range[0]
+        ko_max = np.inf if mobility_range[1] is None else mobility_range[1]
+        shared_inside = None
+
+    start = time.perf_counter()
+    for frame in td.iter_frames(frame_ids, scan_range=scan_ranges):
+        timing.record('read', start, frames=1, peaks=len(frame.indices))
+        progress.check_cancelled()
+        frame_id, scan_begin, num_scans = frame.frame_id, frame.scan_begin, frame.scan_end
+
+        start = time.perf_counter()
+        selector = mz_window_selector(td, frame_id, windows, filter_mode)
+        timing.record('mz_bounds', start)
+        start = time.perf_counter()
+        scan_sums = sum_frame_intensities(frame.offsets, frame.indices, frame.intensities, *selector)
+        timing.record('sum', start)
+
+        start = time.perf_counter()
+        if shared_sums is not None:
+            if mobility_range is not None:
+                # the scans read are the same for every frame, except where a frame has fewer scans
+                if shared_inside is None or len(shared_inside) != num_scans - scan_begin:
+                    ko_axis = td.scanNumToOneOverK0(frame_id, np.arange(scan_begin, num_scans))
+                    shared_inside = (ko_axis >= ko_min) & (ko_axis <= ko_max)
+                scan_sums[:, ~shared_inside] = 0
+            if num_scans > shared_sums.shape[1]:
+                shared_sums = np.pad(shared_sums, ((0, 0), (0, num_scans - shared_sums.shape[1])))
+            shared_sums[:, scan_begin:num_scans] += scan_sums
+        elif scan_sums.any():
+            ko_axis = td.scanNumToOneOverK0(frame_id, np.arange(scan_begin, num_scans))
+            if mobility_range is not None:
+                inside = (ko_axis >= ko_min) & (ko_axis <= ko_max)
+                ko_axis, scan_sums = ko_axis[inside], scan_sums[:, inside]
+            accumulator.add(ko_axis, scan_sums)
+        timing.record('mobility', start)
+        start = time.perf_counter()
+    return shared_sums
+
+def extract_frame_range(input_folder, start, stop, windows, use_recalibrated_state, strategy, filter_mode, mobility_edges=None, frame_ids=None, mobility_range=None):
+    """Accumulate the frames in rows start..stop-1 of the Frames table, or frame_ids[start:stop] if given.
+
+    Every frame is read once and all m/z windows are accumulated from the same raw data. Returns a
+    MobilogramAccumulator, or a MobilityHistogram if mobility_edges defines a 1/K0 grid.
+
+    """
+    if mobility_edges is not None:
+        accumulator = MobilityHistogram(mobility_edges, len(windows))
+    else:
+        accumulator = MobilogramAccumulator(len(windows))
+
+    with openTimsData(input_folder, use_recalibrated_state=use_recalibrated_state, pressure_compensation_strategy=strategy) as td:
+        if frame_ids is None:
+            frames = td.frames[start:stop]
+        else:
+            frames = td.frames[np.searchsorted(td.frames['Id'], frame_ids[start:stop])]
+
+        # with global pressure compensation and one calibration all frames share one mobility axis:
+        # sum by scan number and convert the axis once instead of once per frame
+        shared_axis = shares_mobility_axis(strategy, frames)
+        total_sums = None
+        if shared_axis:
+            max_scans = int(frames['NumScans'].max())
+            total_sums = np.zeros((len(windows), max_scans), dtype=np.uint64)
+
+        total_sums = accumulate_frames(td, frames['Id'], windows, filter_mode, accumulator, total_sums, mobility_range)
+
+        if shared_axis and total_sums.any():
+            ko_axis = td.scanNumToOneOverK0(int(frames['Id'][0]), np.arange(max_scans))
+            accumulator.add(ko_axis, total_sums)
+
+    return accumulator
+
+def frame_shards(total_frames, num_shards):
+    """Split the rows 0..total_frames-1 of the Frames table into at most num_shards contiguous (start, stop) ranges."""
+    bounds = np.linspace(0, total_frames, min(num_shards, total_frames) + 1).astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+def extract_mobilograms(input_folder, windows, use_recalibrated_state=True, pressure_compensation_strategy="Global", filter_mode='index', frame_workers=1, mobility_edges=None, rt_range=None, frame_ranges=None, msms_types=None, mobility_range=None):
+    """Extract the summed mobilograms of several (mzmin, mzmax) windows from a .d folder in one pass.
+
+    With frame_workers > 1 the frame range is split into shards that are extracted in separate
+    worker processes, each with its own TimsData handle; the partial integer sums are reduced
+    into one mobilogram, so the result is identical to the sequential path.
+
+    If mobility_edges is given, intensities are binned on that 1/K0 grid (see MobilityHistogram)
+    and ko holds the bin centers; share the edges between folders to get a common axis.
+
+    rt_range, frame_ranges and msms_types restrict the frames read (see select_frames); the
+    selection is made on the Frames table before any raw data is read. mobility_range
+    (ko_min, ko_max) keeps the scans in that 1/K0 range, and only their scan range is read from
+    every frame (see mobility_scan_ranges).
+
+    Returns a list with one DataFrame per window, with the columns 'ko' and 'intensity' sorted
+    by ko, or None where no peak falls into the window.
+
+    """
+    input_folder = os.path.normpath(input_folder)
+    if not os.path.isdir(input_folder):
+        raise FileNotFoundError(f"The folder {input_folder} does not exist.")
+
+    windows = [(float(mzmin), float(mzmax)) for mzmin, mzmax in windows]
+    strategy = resolve_pressure_compensation_strategy(pressure_compensation_strategy)
+    frame_ids = None
+    if has_frame_selection(rt_range, frame_ranges, msms_types):
+        frame_ids = selected_frame_ids(input_folder, rt_range, frame_ranges, msms_types)
+        total_frames = len(frame_ids)
+    else:
+        total_frames = count_frames(input_folder)
+    shards = frame_shards(total_frames, frame_workers)
+
+    if len(shards) <= 1:
+        accumulator = extract_frame_range(input_folder, 0, total_frames, windows, use_recalibrated_state, strategy, filter_mode, mobility_edges, frame_ids, mobility_range)
+    else:
+        accumulator = None
+        with ProcessPoolExecutor(max_workers=len(shards), **progress.pool_options()) as executor:
+            futures = [
+                timing.submit(executor, extract_frame_range, input_folder, start, stop, windows, use_recalibrated_state, strategy, filter_mode, mobility_edges, frame_ids, mobility_range)
+                for start, stop in shards
+            ]
+            for future in futures:
+                if accumulator is None:
+                    accumulator = timing.result(future)
+                else:
+                    accumulator.merge(timing.result(future))
+
+    with timing.stage('to_frames'):
+        return accumulator.to_frames()
+
+def extract_mobilogram(input_folder, mzmin, mzmax, use_recalibrated_state=True, pressure_compensation_strategy="Global", filter_mode='index', frame_workers=1, mobility_edges=None, rt_range=None, frame_ranges=None, msms_types=None, mobility_range=None):
+    """Extract the summed mobilogram of the m/z window [mzmin, mzmax] from a .d folder.
+
+    Returns a DataFrame with the columns 'ko' and 'intensity' sorted by ko, or None if no peak
+    falls into the window. See extract_mobilograms.
+
+    """
+    return extract_mobilograms(input_folder, [(mzmin, mzmax)], use_recalibrated_state=use_recalibrated_state,
+                               pressure_compensation_strategy=pressure_compensation_strategy,
+                               filter_mode=filter_mode, frame_workers=frame_workers,
+                               mobility_edges=mobility_edges, rt_range=rt_range,
+                               frame_ranges=frame_ranges, msms_types=msms_types,
+                               mobility_range=mobility_range)[0]
+
+def has_chromatogram_engine(td):
+    """True if td reads through the timsdata library, which extractChromatograms needs (other backends have no handle)."""
+    return td.dll is not None and td.handle is not None
+
+def mobility_slice_jobs(mzmin, mzmax, mobility_edges, time_begin, time_end):
+    """Yield one ChromatogramJob per 1/K0 slice [edges[i], edges[i + 1]] of the m/z window; the job id is i.
+
+    All jobs cover the same time range, so they come in the ascending time_begin order that
+    extractChromatograms expects.
+
+    """
+    for slice_number, (ook0_min, ook0_max) in enumerate(zip(mobility_edges[:-1].tolist(), mobility_edges[1:].tolist())):
+        yield ChromatogramJob(slice_number, time_begin, time_end, mzmin, mzmax, ook0_min, ook0_max)
+
+def chromatogram_mobility_matrix(td, mzmin, mzmax, mobility_edges, frame_ids, times):
+    """Intensities (frames x slices) of the m/z window in the 1/K0 slices of the grid, from td.extractChromatograms.
+
+    frame_ids are ascending MS1 frame ids with their retention times; the library extracts all
+    slices in one pass over the frames between the first and the last time, and trace points of
+    frames outside frame_ids are dropped.
+
+    """
+    matrix = np.zeros((len(frame_ids), len(mobility_edges) - 1), dtype=np.uint64)
+    if len(frame_ids) == 0:
+        return matrix
+
+    def add_trace(job_id, trace_frame_ids, values):
+        rows = np.minimum(np.searchsorted(frame_ids, trace_frame_ids), len(frame_ids) - 1)
+        known = frame_ids[rows] == trace_frame_ids
+        matrix[rows[known], job_id] += values[known]
+
+    # widen the time range by a second so that the first and the last frame are never cut off
+    jobs = mobility_slice_jobs(float(mzmin), float(mzmax), mobility_edges, float(times[0]) - 1.0, float(times[-1]) + 1.0)
+    td.extractChromatograms(jobs, add_trace)
+    return matrix
+
+def scan_mobility_matrix(td, mzmin, mzmax, mobility_edges, frame_ids, filter_mode='index'):
+    """The matrix of chromatogram_mobility_matrix, summed in Python from the scans of every frame.
+
+    Only the scans covering the grid are read (see mobility_scan_ranges).
+
+    """
+    num_bins = len(mobility_edges) - 1
+    matrix = np.zeros((len(frame_ids), num_bins), dtype=np.uint64)
+    scan_ranges = mobility_scan_ranges(td, frame_ids, (mobility_edges[0], mobility_edges[-1]))
+
+    start = time.perf_counter()
+    for row, frame in enumerate(td.iter_frames(frame_ids, scan_range=scan_ranges)):
+        timing.record('read', start, frames=1, peaks=len(frame.indices))
+        progress.check_cancelled()
+
+        start = time.perf_counter()
+        selector = mz_window_selector(td, frame.frame_id, [(mzmin, mzmax)], filter_mode)
+        scan_sums = sum_frame_intensities(frame.offsets, frame.indices, frame.intensities, *selector)[0]
+        timing.record('sum', start)
+
+        start = time.perf_counter()
+        if scan_sums.any():
+            ko_axis = td.scanNumToOneOverK0(frame.frame_id, np.arange(frame.scan_begin, frame.scan_end))
+            bins, valid = mobility_bin_numbers(mobility_edges, ko_axis)
+            matrix[row] = np.bincount(bins[valid], weights=scan_sums[valid], minlength=num_bins).astype(np.uint64)
+        timing.record('mobility', start)
+        start = time.perf_counter()
+    return matrix
+
+class TimeResolvedMobilogram:
+    """Intensities of one m/z window per MS1 frame (rows) and 1/K0 bin (columns)."""
+
+    def __init__(self, frame_ids, times, edges, intensities):
+        self.frame_ids = frame_ids
+        self.times = times
+        self.edges = edges
+        self.intensities = intensities
+
+    @property
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+    def summed(self):
+        """The mobilogram summed over all frames as a DataFrame (ko = bin center, intensity), or None if empty."""
+        sums = self.intensities.sum(axis=0, dtype=np.uint64)
+        return pd.DataFrame({'ko': self.centers, 'intensity': sums}) if sums.any() else None
+
+    def to_frame(self):
+        """One row per frame with the columns 'frame', 'time' and one column per bin center."""
+        frame = pd.DataFrame(self.intensities, columns=self.centers)
+        frame.insert(0, 'time', self.times)
+        frame.insert(0, 'frame', self.frame_ids)
+        return frame
+
+def extract_time_resolved_mobilogram(input_folder, mzmin, mzmax, mobility_edges, use_recalibrated_state=True, pressure_compensation_strategy="Global", rt_range=None, method='auto', filter_mode='index'):
+    """Extract the intensities of the m/z window [mzmin, mzmax] per MS1 frame and bin of the 1/K0 grid mobility_edges.
+
+    method 'chromatograms' extracts one trace per bin with the XIC engine of the timsdata library
+    (see chromatogram_mobility_matrix), 'scans' sums the scans of every frame in Python, and
+    'auto' takes the library where the backend has one. Both give the same matrix up to peaks
+    right on a bin edge or an m/z bound, which the library may assign differently. The library
+    only extracts MS1 frames, so MS/MS frames are left out either way; rt_range (rt_min, rt_max)
+    restricts the frames further.
+
+    Returns a TimeResolvedMobilogram.
+
+    """
+    input_folder = os.path.normpath(input_folder)
+    if not os.path.isdir(input_folder):
+        raise FileNotFoundError(f"The folder {input_folder} does not exist.")
+    if method not in ('auto', 'chromatograms', 'scans'):
+        raise ValueError(f"Unknown extraction method: {method}")
+
+    mobility_edges = np.asarray(mobility_edges, dtype=np.float64)
+    strategy = resolve_pressure_compensation_strategy(pressure_compensation_strategy)
+    with openTimsData(input_folder, use_recalibrated_state=use_recalibrated_state, pressure_compensation_strategy=strategy) as td:
+        frame_ids = select_frames(td.frames, rt_range, msms_types=[0])
+        times = td.frames['Time'][np.searchsorted(td.frames['Id'], frame_ids)]
+        if method == 'auto':
+            method = 'chromatograms' if has_chromatogram_engine(td) else 'scans'
+        if method == 'chromatograms':
+            if not has_chromatogram_engine(td):
+                raise RuntimeError("Chromatogram extraction needs the timsdata library.")
+            start = time.perf_counter()
+            intensities = chromatogram_mobility_matrix(td, mzmin, mzmax, mobility_edges, frame_ids, times)
+            timing.record('chromatograms', start, frames=len(frame_ids))
+        else:
+            intensities = scan_mobility_matrix(td, mzmin, mzmax, mobility_edges, frame_ids, filter_mode)
+    return TimeResolvedMobilogram(frame_ids, times, mobility_edges, intensities)
+
+class LiveMobilogram:
+    """Running mobilograms of an analysis that is still being acquired.
+
+    Every update() reads only the frames with an Id above the last frame read, so an update costs
+    O(new frames). The analysis is opened again for every update, since neither the timsdata
+    library nor an open SQLite snapshot see frames written later. A mobility grid requested by
+    bin width or count is laid over the frames present at the first update. New frames outside
+    rt_range, frame_ranges and msms_types (see select_frames) are skipped, and only the scans in
+    mobility_range are read.
+
+    """
+
+    def __init__(self, input_folder, windows, use_recalibrated_state=True, pressure_compensation_strategy="Global", filter_mode='index', mobility_bin_width=None, mobility_bin_count=None, rt_range=None, frame_ranges=None, msms_types=None, mobility_range=None):
+        self.input_folder = os.path.normpath(input_folder)
+        self.windows = [(float(mzmin), float(mzmax)) for mzmin, mzmax in windows]
+        self.use_recalibrated_state = use_recalibrated_state
+        self.strategy = resolve_pressure_compensation_strategy(pressure_compensation_strategy)
+        self.filter_mode = filter_mode
+        self.mobility_bin_width = mobility_bin_width
+        self.mobility_bin_count = mobility_bin_count
+        self.rt_range = rt_range
+        self.frame_ranges = frame_ranges
+        self.msms_types = msms_types
+        self.mobility_range = mobility_range
+        self.accumulator = None
+        self.last_frame_id = 0
+        self.frame_count = 0
+        # with global pressure compensation the frames are summed by scan number (see extract_frame_range);
+        # the axis is converted again on every update, since the global pressure may still change.
+        # shared_frame is the row of the Frames table whose axis the shared sums use
+        self.shared_sums = None
+        self.shared_axis = None
+        self.shared_frame = None
+
+    def update(self):
+        """Read the selected frames added since the last update; returns the number of frames added."""
+        with openTimsData(self.input_folder, use_recalibrated_state=self.use_recalibrated_state,
+                          pressure_compensation_strategy=self.strategy, immutable=False) as td:
+            frames = td.frames
+            if len(frames) == 0:
+                return 0
+            if self.accumulator is None:
+                if self.mobility_bin_width or self.mobility_bin_count:
+                    ko_min, ko_max = frames_mobility_range(td)
+                    self.accumulator = MobilityHistogram(mobility_grid_edges(ko_min, ko_max, self.mobility_bin_width, self.mobility_bin_count), len(self.windows))
+                else:
+                    self.accumulator = MobilogramAccumulator(len(self.windows))
+                if self.strategy == PressureCompensationStrategy.AnalyisGlobalPressureCompensation:
+                    self.shared_sums = np.zeros((len(self.windows), 0), dtype=np.uint64)
+
+            new_frames = frames[np.searchsorted(frames['Id'], self.last_frame_id, side='right'):]
+            if len(new_frames) == 0:
+                return 0
+            new_ids = select_frames(new_frames, self.rt_range, self.frame_ranges, self.msms_types)
+            selected = new_frames[np.isin(new_frames['Id'], new_ids)]
+            shared_frame = self.shared_frame
+            if self.shared_sums is not None and shared_frame is None and len(selected) > 0:
+                shared_frame = selected[:1]
+            # frames of another calibration have another mobility axis: from then on every frame is
+            # converted on its own, and the sums so far are added with their axis below
+            keep_shared = self.shared_sums is not None and (shared_frame is None or shares_mobility_axis(self.strategy, np.concatenate((shared_frame, selected))))
+            # the new frames go into empty sums first: if reading fails half way, the poll is retried
+            # from the same state instead of counting the frames read before the error twice
+            accumulator = self.accumulator.empty()
+            shared_sums = np.zeros((len(self.windows), 0), dtype=np.uint64) if keep_shared else None
+            shared_sums = accumulate_frames(td, new_ids, self.windows, self.filter_mode, accumulator, shared_sums, self.mobility_range)
+            if shared_frame is not None:
+                num_scans = max(self.shared_sums.shape[1], 0 if shared_sums is None else shared_sums.shape[1])
+                shared_axis = td.scanNumToOneOverK0(int(shared_frame['Id'][0]), np.arange(num_scans))
+
+        self.accumulator.merge(accumulator)
+        if shared_frame is not None:
+            self.shared_sums = np.pad(self.shared_sums, ((0, 0), (0, num_scans - self.shared_sums.shape[1])))
+            if shared_sums is not None:
+                self.shared_sums[:, :shared_sums.shape[1]] += shared_sums
+            self.shared_axis = shared_axis
+            self.shared_frame = shared_frame
+        if self.shared_sums is not None and not keep_shared:
+            if self.shared_sums.any():
+                self.accumulator.add(self.shared_axis, self.shared_sums)
+            self.shared_sums = None
+            self.shared_frame = None
+        self.last_frame_id = int(new_frames['Id'][-1])
+        self.frame_count += len(new_ids)
+        return len(new_frames)
+
+    def to_frames(self):
+        """Return the current mobilogram of every window (see extract_mobilograms)."""
+        if self.accumulator is None:
+            return [None] * len(self.windows)
+        if self.shared_sums is None or not self.shared_sums.any():
+            return self.accumulator.to_frames()
+        accumulator = copy.deepcopy(self.accumulator)
+        accumulator.add(self.shared_axis, self.shared_sums)
+        return accumulator.to_frames()
+
+def watch_mobilograms(live, poll_interval=2.0, idle_timeout=None, on_update=None, on_status=print):
+    """Poll a LiveMobilogram until no frame was added for idle_timeout seconds (forever if None).
+
+    on_update(live) is called after every update that read new frames. Errors while the
+    acquisition is writing (e.g. a locked or not yet created analysis.tdf) are reported through
+    on_status and retried at the next poll.
+
+    """
+    last_change = time.monotonic()
+    while True:
+        try:
+            new_frames = live.update()
+        except (sqlite3.Error, OSError, RuntimeError) as e:
+            on_status(f"Waiting for {live.input_folder}: {e}")
+            new_frames = 0
+        if new_frames:
+            last_change = time.monotonic()
+            if on_update:
+                on_update(live)
+        elif idle_timeout is not None and time.monotonic() - last_change >= idle_timeout:
+            return live
+        time.sleep(poll_interval)
+
+def print_mobilograms(windows, results, file=None):
+    for (mzmin, mzmax), grouped in zip(windows, results):
+        if len(windows) > 1:
+            print(f"# mz range {mzmin}-{mzmax}", file=file)
+        if grouped is not None:
+            print(grouped.to_csv(index=False), file=file)
+        else:
+            print("No data to process.", file=file)
+
+def write_mobilograms(output_path, windows, results):
+    # replace the file in one step so that a reader never sees a half-written refresh
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        print_mobilograms(windows, results, file=f)
+    os.replace(tmp_path, output_path)
+
+def str_to_bool(value):
+    return str(value).strip().lower() in ('true', '1', 'yes')
+
 def main():
     parser = argparse.ArgumentParser(description='Process some data.')
     parser.add_argument('input_folder', type=str, help='Path to the input .d folder')
-    parser.add_argument('--mzmin', type=float, required=True, help='Minimum mz value')
-    parser.add_argument('--mzmax', type=float, required=True, help='Maximum mz value')
-    parser.add_argument('--use_recalibrated_state', type=bool, default=True, help='Whether to use recalibrated state')
+    parser.add_argument('--mzmin', type=float, help='Minimum mz value')
+    parser.add_argument('--mzmax', type=float, help='Maximum mz value')
+    parser.add_argument('--window', type=float, nargs=2, action='append', default=[], metavar=('MZMIN', 'MZMAX'), help='Additional m/z window; may be given several times, all windows are extracted in one pass')
+    parser.add_argument('--use_recalibrated_state', type=str_to_bool, default=True, help='Whether to use recalibrated state')
     parser.add_argument('--pressure_compensation_strategy', type=str, default='AnalysisGlobalPressureCompensation', help='Pressure compensation strategy to use')
+    parser.add_argument('--filter_mode', type=str, default='index', choices=['index', 'mz'], help='Filter peaks on raw TOF indices (index) or on converted m/z values (mz)')
+    parser.add_argument('--frame_workers', type=int, default=1, help='Number of worker processes sharing the frames of the analysis')
+    parser.add_argument('--mobility_bin_width', type=float, help='Bin intensities on a 1/K0 grid with this bin width')
+    parser.add_argument('--mobility_bin_count', type=int, help='Bin intensities on a 1/K0 grid with this number of bins')
+    parser.add_argument('--rt_min', type=float, help='Only read frames with a retention time (Frames.Time, s) of at least this value')
+    parser.add_argument('--rt_max', type=float, help='Only read frames with a retention time (Frames.Time, s) of at most this value')
+    parser.add_argument('--frames', type=parse_frame_ranges, help="Only read these frame ids, e.g. '1-500;800-900'")
+    parser.add_argument('--msms_type', type=int, action='append', help='Only read frames of this MsMsType (0 = MS1); may be given several times')
+    parser.add_argument('--ko_min', type=float, help='Only read the scans with a 1/K0 of at least this value')
+    parser.add_argument('--ko_max', type=float, help='Only read the scans with a 1/K0 of at most this value')
+    parser.add_argument('--watch', action='store_true', help='Follow an analysis that is still being acquired, reading only new frames')
+    parser.add_argument('--poll_interval', type=float, default=2.0, help='Seconds between two polls in watch mode')
+    parser.add_argument('--idle_timeout', type=float, help='Stop watching when no frame was added for this many seconds (default: until interrupted)')
+    parser.add_argument('--time_resolved', action='store_true', help='Extract the intensity of every MS1 frame per 1/K0 bin instead of the summed mobilogram (one window, needs --mobility_bin_width or --mobility_bin_count)')
+    parser.add_argument('--method', type=str, default='auto', choices=['auto', 'chromatograms', 'scans'], help='Time-resolved extraction with the chromatogram engine of timsdata.dll (chromatograms), the scan loop (scans) or whichever the backend supports (auto)')
+    parser.add_argument('--output', type=str, help='CSV file refreshed after every update in watch mode, or written by --time_resolved')
+    parser.add_argument('--timings', type=str, help='Write the time and peak memory (traced with tracemalloc, which slows the extraction down) per stage to this JSON file')
+    parser.add_argument('--profile', type=str, help='Write cProfile statistics of the extraction to this file')
     
     args = parser.parse_args()
 
     input_folder = os.path.normpath(args.input_folder)
-    mzmin = args.mzmin
-    mzmax = args.mzmax
-    use_recalibrated_state = args.use_recalibrated_state
-    pressure_compensation_strategy = args.pressure_compensation_strategy
 
     if not os.path.isdir(input_folder):
         print(f"Error: The folder {input_folder} does not exist.")
         sys.exit(1)
 
-    # Map the UI string to the actual strategy
-    strategy_mapping = {
-        "No compensation": PressureCompensationStrategy.NoPressureCompensation,
-        "Per-frame": PressureCompensationStrategy.PerFramePressureCompensation,
-        "Global": PressureCompensationStrategy.AnalyisGlobalPressureCompensation
-    }
+    windows = list(args.window)
+    if args.mzmin is not None or args.mzmax is not None:
+        if args.mzmin is None or args.mzmax is None:
+            parser.error("--mzmin and --mzmax must be given together")
+        windows.insert(0, (args.mzmin, args.mzmax))
+    if not windows:
+        parser.error("either --mzmin/--mzmax or --window is required")
+    if args.time_resolved:
+        if len(windows) > 1 or args.watch:
+            parser.error("--time_resolved extracts a single m/z window and cannot be combined with --watch")
+        if not (args.mobility_bin_width or args.mobility_bin_count):
+            parser.error("--time_resolved needs --mobility_bin_width or --mobility_bin_count")
 
-    td = TimsData(input_folder, use_recalibrated_state=use_recalibrated_state, pressure_compensation_strategy=strategy_mapping[pressure_compensation_strategy])
-    conn = td.conn
-    
-    # Get total frame count
-    q = conn.execute("SELECT COUNT(*) FROM Frames")
-    row = q.fetchone()
-    total_frames = row[0]
-
-    all_data = []
-
-    for frame_id in range(1, total_frames + 1):
-        q = conn.execute(f"SELECT NumScans FROM Frames WHERE Id={frame_id}")
-        num_scans = q.fetchone()[0]
-
-        scans = td.readScans(frame_id, 0, num_scans)
-        
-        for scan_idx, (index_array, intensity_array) in enumerate(scans):
-            mz_array = td.indexToMz(frame_id, index_array)
-            
-            filter_mask = (mz_array >= mzmin) & (mz_array <= mzmax)
-            mz_filtered = mz_array[filter_mask]
-            intensities_filtered = intensity_array[filter_mask]
-            
-            if len(mz_filtered) > 0:
-                ko_values = td.scanNumToOneOverK0(frame_id, np.array([scan_idx]))
-                ko_values_filtered = np.full(len(mz_filtered), ko_values[0])
-
-                data = pd.DataFrame({'ko': ko_values_filtered, 'intensity': intensities_filtered})
-                all_data.append(data)
-
-    if all_data:
-        combined_data = pd.concat(all_data, ignore_index=True)
-        grouped = combined_data.groupby(['ko'])['intensity'].sum().reset_index()
-        print(grouped.to_csv(index=False))
-    else:
-        print("No data to process.")
+    rt_range = (args.rt_min, args.rt_max) if args.rt_min is not None or args.rt_max is not None else None
+    mobility_range = (args.ko_min, args.ko_max) if args.ko_min is not None or args.ko_max is not None else None
+
+    if args.watch:
+        live = LiveMobilogram(input_folder, windows, args.use_recalibrated_state, args.pressure_compensation_strategy,
+                              args.filter_mode, args.mobility_bin_width, args.mobility_bin_count,
+                              rt_range, args.frames, args.msms_type, mobility_range)
+
+        def on_update(live):
+            print(f"{live.frame_count} frames read (last frame {live.last_frame_id})", file=sys.stderr)
+            if args.output:
+                write_mobilograms(args.output, windows, live.to_frames())
+
+        try:
+            watch_mobilograms(live, args.poll_interval, args.idle_timeout, on_update, on_status=lambda message: print(message, file=sys.stderr))
+        except KeyboardInterrupt:
+            pass
+        print_mobilograms(windows, live.to_frames())
+        return
+
+    mobility_edges = None
+    if args.mobility_bin_width or args.mobility_bin_count:
+        ko_min, ko_max = analysis_mobility_range(input_folder, args.use_recalibrated_state, args.pressure_compensation_strategy)
+        mobility_edges = mobility_grid_edges(ko_min, ko_max, args.mobility_bin_width, args.mobility_bin_count)
+
+    timings = timing.StageTimings(track_memory=True) if args.timings else None
+    with timing.profiled(args.profile), timing.activate(timings):
+        if args.time_resolved:
+            result = extract_time_resolved_mobilogram(input_folder, *windows[0], mobility_edges,
+                                                      use_recalibrated_state=args.use_recalibrated_state,
+                                                      pressure_compensation_strategy=args.pressure_compensation_strategy,
+                                                      rt_range=rt_range,
+                                                      method=args.method,
+                                                      filter_mode=args.filter_mode)
+            with timing.stage('print'):
+                if args.output:
+                    result.to_frame().to_csv(args.output, index=False)
+                else:
+                    print(result.to_frame().to_csv(index=False))
+        else:
+            results = extract_mobilograms(input_folder, windows,
+                                          use_recalibrated_state=args.use_recalibrated_state,
+                                          pressure_compensation_strategy=args.pressure_compensation_strategy,
+                                          filter_mode=args.filter_mode,
+                                          frame_workers=args.frame_workers,
+                                          mobility_edges=mobility_edges,
+                                          rt_range=rt_range,
+                                          frame_ranges=args.frames,
+                                          msms_types=args.msms_type,
+                                          mobility_range=mobility_range)
+            with timing.stage('print'):
+                print_mobilograms(windows, results)
+
+    if timings is not None:
+        with open(args.timings, 'w') as f:
+            json.dump(timings.to_dict(), f, indent=2)
+        print(f"{timings.status()}, timings written to {args.timings}", file=sys.stderr)
 
 if __name__ == '__main__':
     main()
@@ -8,16 +8,20 @@ import numpy as np
 import sqlite3
 from ctypes import *
 from pathlib import Path
+from urllib.parse import quote
 from enum import Enum
+from collections import namedtuple
 
 if getattr(sys, 'frozen', False):
     # Running in a bundle
     bundle_dir = sys._MEIPASS
     dll_path = os.path.join(bundle_dir, 'timsdata.dll')
-    os.add_dll_directory(os.path.dirname(dll_path))
+    if hasattr(os, 'add_dll_directory'):  # Windows only
+        os.add_dll_directory(os.path.dirname(dll_path))
 else:
     # Running in normal Python environment
-    os.add_dll_directory(os.getcwd())
+    if hasattr(os, 'add_dll_directory'):  # Windows only
+        os.add_dll_directory(os.getcwd())
     dll_path = os.path.join(os.getcwd(), 'timsdata.dll')
     
 
@@ -26,42 +30,26 @@ if sys.platform[:5] == "win32":
 elif sys.platform[:5] == "linux":
     libname = "libtimsdata.so"
 else:
-    raise Exception("Unsupported platform.")
+    libname = None
+
+# without the vendor library only the DLL-free backends (see openTimsData) can be used; the reason
+# is kept for the error raised when the library is needed (e.g. a missing VC runtime on Windows)
+dll = None
+dll_load_error = "no timsdata library for platform {0}".format(sys.platform)
+if libname is not None:
+    path = Path(Path(__file__).parent.absolute(), 'libs', libname).as_posix()
+    try:
+        if os.path.exists(path):
+            dll = cdll.LoadLibrary(path)
+        else:
+            dll = cdll.LoadLibrary(libname)
+        dll_load_error = None
+    except OSError as e:
+        dll = None
+        dll_load_error = str(e)
 
-path = Path(Path(__file__).parent.absolute(), 'libs', libname).as_posix()
-if os.path.exists(path):
-    dll = cdll.LoadLibrary(path)
-else:
-    dll = cdll.LoadLibrary(libname)
-    
-dll.tims_open_v2.argtypes = [ c_char_p, c_uint32, c_uint32 ]
-dll.tims_open_v2.restype = c_uint64
-dll.tims_close.argtypes = [ c_uint64 ]
-dll.tims_close.restype = None
-dll.tims_get_last_error_string.argtypes = [ c_char_p, c_uint32 ]
-dll.tims_get_last_error_string.restype = c_uint32
-dll.tims_has_recalibrated_state.argtypes = [ c_uint64 ]
-dll.tims_has_recalibrated_state.restype = c_uint32
-dll.tims_read_scans_v2.argtypes = [ c_uint64, c_int64, c_uint32, c_uint32, c_void_p, c_uint32 ]
-dll.tims_read_scans_v2.restype = c_uint32
 MSMS_SPECTRUM_FUNCTOR = CFUNCTYPE(None, c_int64, c_uint32, POINTER(c_double), POINTER(c_float))
-dll.tims_read_pasef_msms.argtypes = [ c_uint64, POINTER(c_int64), c_uint32, MSMS_SPECTRUM_FUNCTOR ]
-dll.tims_read_pasef_msms.restype = c_uint32
-dll.tims_read_pasef_msms_for_frame.argtypes = [ c_uint64, c_int64, MSMS_SPECTRUM_FUNCTOR ]
-dll.tims_read_pasef_msms_for_frame.restype = c_uint32
 MSMS_PROFILE_SPECTRUM_FUNCTOR = CFUNCTYPE(None, c_int64, c_uint32, POINTER(c_int32))
-dll.tims_read_pasef_profile_msms.argtypes = [ c_uint64, POINTER(c_int64), c_uint32, MSMS_PROFILE_SPECTRUM_FUNCTOR ]
-dll.tims_read_pasef_profile_msms.restype = c_uint32
-dll.tims_read_pasef_profile_msms_for_frame.argtypes = [ c_uint64, c_int64, MSMS_PROFILE_SPECTRUM_FUNCTOR ]
-dll.tims_read_pasef_profile_msms_for_frame.restype = c_uint32
-
-dll.tims_extract_centroided_spectrum_for_frame_v2.argtypes = [ c_uint64, c_int64, c_uint32, c_uint32, MSMS_SPECTRUM_FUNCTOR, c_void_p ]
-dll.tims_extract_centroided_spectrum_for_frame_v2.restype = c_uint32
-dll.tims_extract_centroided_spectrum_for_frame_ext.argtypes = [ c_uint64, c_int64, c_uint32, c_uint32, c_double, MSMS_SPECTRUM_FUNCTOR, c_void_p ]
-dll.tims_extract_centroided_spectrum_for_frame_ext.restype = c_uint32
-dll.tims_extract_profile_for_frame.argtypes = [ c_uint64, c_int64, c_uint32, c_uint32, MSMS_PROFILE_SPECTRUM_FUNCTOR, c_void_p ]
-dll.tims_extract_profile_for_frame.restype = c_uint32
-
 class ChromatogramJob(Structure):
     _fields_ = [
         ("id",c_int64),
@@ -70,32 +58,60 @@ class ChromatogramJob(Structure):
         ("ook0_min",c_double),   ("ook0_max",c_double)
     ]
 CHROMATOGRAM_JOB_GENERATOR = CFUNCTYPE(c_uint32, POINTER(ChromatogramJob), c_void_p)
-CHROMATOGRAM_TRACE_SINK = CFUNCTYPE(c_uint32, c_int64, c_uint32, POINTER(c_int64), POINTER(c_uint64), c_void_p)  
-dll.tims_extract_chromatograms.argtypes = [ c_uint64, CHROMATOGRAM_JOB_GENERATOR, CHROMATOGRAM_TRACE_SINK, c_void_p ]
-dll.tims_extract_chromatograms.restype = c_uint32
+CHROMATOGRAM_TRACE_SINK = CFUNCTYPE(c_uint32, c_int64, c_uint32, POINTER(c_int64), POINTER(c_uint64), c_void_p)
 
 convfunc_argtypes = [ c_uint64, c_int64, POINTER(c_double), POINTER(c_double), c_uint32 ]
 
-dll.tims_index_to_mz.argtypes = convfunc_argtypes
-dll.tims_index_to_mz.restype = c_uint32
-dll.tims_mz_to_index.argtypes = convfunc_argtypes
-dll.tims_mz_to_index.restype = c_uint32
-
-dll.tims_scannum_to_oneoverk0.argtypes = convfunc_argtypes
-dll.tims_scannum_to_oneoverk0.restype = c_uint32
-dll.tims_oneoverk0_to_scannum.argtypes = convfunc_argtypes
-dll.tims_oneoverk0_to_scannum.restype = c_uint32
-
-dll.tims_scannum_to_voltage.argtypes = convfunc_argtypes
-dll.tims_scannum_to_voltage.restype = c_uint32
-dll.tims_voltage_to_scannum.argtypes = convfunc_argtypes
-dll.tims_voltage_to_scannum.restype = c_uint32
-
-dll.tims_oneoverk0_to_ccs_for_mz.argtypes = [c_double, c_int32, c_double]
-dll.tims_oneoverk0_to_ccs_for_mz.restype = c_double
-
-dll.tims_ccs_to_oneoverk0_for_mz.argtypes = [c_double, c_int32, c_double]
-dll.tims_ccs_to_oneoverk0_for_mz.restype = c_double
+if dll is not None:
+    dll.tims_open_v2.argtypes = [ c_char_p, c_uint32, c_uint32 ]
+    dll.tims_open_v2.restype = c_uint64
+    dll.tims_close.argtypes = [ c_uint64 ]
+    dll.tims_close.restype = None
+    dll.tims_get_last_error_string.argtypes = [ c_char_p, c_uint32 ]
+    dll.tims_get_last_error_string.restype = c_uint32
+    dll.tims_has_recalibrated_state.argtypes = [ c_uint64 ]
+    dll.tims_has_recalibrated_state.restype = c_uint32
+    dll.tims_read_scans_v2.argtypes = [ c_uint64, c_int64, c_uint32, c_uint32, c_void_p, c_uint32 ]
+    dll.tims_read_scans_v2.restype = c_uint32
+    dll.tims_read_pasef_msms.argtypes = [ c_uint64, POINTER(c_int64), c_uint32, MSMS_SPECTRUM_FUNCTOR ]
+    dll.tims_read_pasef_msms.restype = c_uint32
+    dll.tims_read_pasef_msms_for_frame.argtypes = [ c_uint64, c_int64, MSMS_SPECTRUM_FUNCTOR ]
+    dll.tims_read_pasef_msms_for_frame.restype = c_uint32
+    dll.tims_read_pasef_profile_msms.argtypes = [ c_uint64, POINTER(c_int64), c_uint32, MSMS_PROFILE_SPECTRUM_FUNCTOR ]
+    dll.tims_read_pasef_profile_msms.restype = c_uint32
+    dll.tims_read_pasef_profile_msms_for_frame.argtypes = [ c_uint64, c_int64, MSMS_PROFILE_SPECTRUM_FUNCTOR ]
+    dll.tims_read_pasef_profile_msms_for_frame.restype = c_uint32
+
+    dll.tims_extract_centroided_spectrum_for_frame_v2.argtypes = [ c_uint64, c_int64, c_uint32, c_uint32, MSMS_SPECTRUM_FUNCTOR, c_void_p ]
+    dll.tims_extract_centroided_spectrum_for_frame_v2.restype = c_uint32
+    dll.tims_extract_centroided_spectrum_for_frame_ext.argtypes = [ c_uint64, c_int64, c_uint32, c_uint32, c_double, MSMS_SPECTRUM_FUNCTOR, c_void_p ]
+    dll.tims_extract_centroided_spectrum_for_frame_ext.restype = c_uint32
+    dll.tims_extract_profile_for_frame.argtypes = [ c_uint64, c_int64, c_uint32, c_uint32, MSMS_PROFILE_SPECTRUM_FUNCTOR, c_void_p ]
+    dll.tims_extract_profile_for_frame.restype = c_uint32
+
+    dll.tims_extract_chromatograms.argtypes = [ c_uint64, CHROMATOGRAM_JOB_GENERATOR, CHROMATOGRAM_TRACE_SINK, c_void_p ]
+    dll.tims_extract_chromatograms.restype = c_uint32
+
+    dll.tims_index_to_mz.argtypes = convfunc_argtypes
+    dll.tims_index_to_mz.restype = c_uint32
+    dll.tims_mz_to_index.argtypes = convfunc_argtypes
+    dll.tims_mz_to_index.restype = c_uint32
+
+    dll.tims_scannum_to_oneoverk0.argtypes = convfunc_argtypes
+    dll.tims_scannum_to_oneoverk0.restype = c_uint32
+    dll.tims_oneoverk0_to_scannum.argtypes = convfunc_argtypes
+    dll.tims_oneoverk0_to_scannum.restype = c_uint32
+
+    dll.tims_scannum_to_voltage.argtypes = convfunc_argtypes
+    dll.tims_scannum_to_voltage.restype = c_uint32
+    dll.tims_voltage_to_scannum.argtypes = convfunc_argtypes
+    dll.tims_voltage_to_scannum.restype = c_uint32
+
+    dll.tims_oneoverk0_to_ccs_for_mz.argtypes = [c_double, c_int32, c_double]
+    dll.tims_oneoverk0_to_ccs_for_mz.restype = c_double
+
+    dll.tims_ccs_to_oneoverk0_for_mz.argtypes = [c_double, c_int32, c_double]
+    dll.tims_ccs_to_oneoverk0_for_mz.restype = c_double
 
 def _throwLastTimsDataError (dll_handle):
     """Throw last TimsData error string as an exception."""
@@ -105,13 +121,52 @@ def _throwLastTimsDataError (dll_handle):
     dll_handle.tims_get_last_error_string(buf, len)
     raise RuntimeError(buf.value)
 
-# Convert 1/K0 to CCS for a given charge and mz
+def _convertProportional(func, values, charge, mz):
+    """Apply a DLL conversion that is proportional to its first argument to a whole array.
+
+    The factor comes from a single DLL call and is checked against the DLL at the largest value;
+    if it does not match, every value is passed to the DLL instead.
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    charge, mz = int(charge), float(mz)
+    if values.size == 0:
+        return np.empty(values.shape, dtype=np.float64)
+    factor = func(1.0, charge, mz)
+    probe = float(np.abs(values).max())
+    if np.isclose(factor * probe, func(probe, charge, mz), rtol=1e-9, atol=0):
+        return values * factor
+    result = np.empty(values.shape, dtype=np.float64)
+    for idx, value in enumerate(values.flat):
+        result.flat[idx] = func(float(value), charge, mz)
+    return result
+
+# Mason-Schamp parameters for CCS conversion without the timsdata library (N2 drift gas)
+CCS_CONSTANT = 18509.8632163405
+GAS_MASS = 28.00615
+GAS_TEMPERATURE = 305.0
+
+def _ccsPerOneOverK0(charge, mz):
+    reduced_mass = mz * charge * GAS_MASS / (mz * charge + GAS_MASS)
+    return CCS_CONSTANT * charge / np.sqrt(reduced_mass * GAS_TEMPERATURE)
+
+# Convert 1/K0 to CCS for a given charge and mz (ook0 may be a NumPy array)
 def oneOverK0ToCCSforMz(ook0, charge, mz):
-    return dll.tims_oneoverk0_to_ccs_for_mz(ook0, charge, mz)
-
-# Convert CCS to 1/K0 for a given charge and mz
+    if dll is None:
+        ccs = np.asarray(ook0, dtype=np.float64) * _ccsPerOneOverK0(int(charge), float(mz))
+        return float(ccs) if np.ndim(ook0) == 0 else ccs
+    if np.ndim(ook0) == 0:
+        return dll.tims_oneoverk0_to_ccs_for_mz(ook0, charge, mz)
+    return _convertProportional(dll.tims_oneoverk0_to_ccs_for_mz, ook0, charge, mz)
+
+# Convert CCS to 1/K0 for a given charge and mz (ccs may be a NumPy array)
 def ccsToOneOverK0ToCCSforMz(ccs, charge, mz):
-    return dll.tims_ccs_to_oneoverk0_for_mz(ccs, charge, mz)
+    if dll is None:
+        ook0 = np.asarray(ccs, dtype=np.float64) / _ccsPerOneOverK0(int(charge), float(mz))
+        return float(ook0) if np.ndim(ccs) == 0 else ook0
+    if np.ndim(ccs) == 0:
+        return dll.tims_ccs_to_oneoverk0_for_mz(ccs, charge, mz)
+    return _convertProportional(dll.tims_ccs_to_oneoverk0_for_mz, ccs, charge, mz)
 
 
 class PressureCompensationStrategy(Enum):
@@ -120,8 +175,47 @@ class PressureCompensationStrategy(Enum):
     PerFramePressureCompensation = 2
 
 
+# Columns of the Frames table loaded by TimsData.frames (those missing in older files are skipped)
+FRAME_COLUMNS = [
+    ('Id', np.int64),
+    ('Time', np.float64),
+    ('ScanMode', np.int32),
+    ('MsMsType', np.int32),
+    ('TimsId', np.int64),
+    ('MaxIntensity', np.int64),
+    ('SummedIntensities', np.int64),
+    ('NumScans', np.int64),
+    ('NumPeaks', np.int64),
+    ('MzCalibration', np.int64),
+    ('T1', np.float64),
+    ('T2', np.float64),
+    ('TimsCalibration', np.int64),
+    ('PropertyGroup', np.int64),
+    ('AccumulationTime', np.float64),
+    ('RampTime', np.float64),
+    ('Pressure', np.float64),
+]
+
+def connectAnalysisTdf (analysis_directory, immutable=True):
+    """Open the analysis.tdf of an analysis read-only, and as immutable unless immutable=False.
+
+    The SQLite URI is built with an empty authority ('file://' + absolute path), since SQLite
+    rejects any other: a UNC path \\\\server\\share\\x.d becomes file:////server/share/x.d.
+
+    """
+    path = os.path.abspath(os.path.join(analysis_directory, "analysis.tdf")).replace(os.sep, '/')
+    if not path.startswith('/'):
+        path = '/' + path  # drive letter
+    tdf_uri = 'file://' + quote(path, safe='/:') + ("?mode=ro&immutable=1" if immutable else "?mode=ro")
+    return sqlite3.connect(tdf_uri, uri=True)
+
+# One frame yielded by TimsData.iter_frames; the peaks of scan scan_begin+i are
+# indices[offsets[i]:offsets[i+1]] and intensities[offsets[i]:offsets[i+1]]
+FrameRecord = namedtuple('FrameRecord', ['frame_id', 'scan_begin', 'scan_end', 'offsets', 'indices', 'intensities'])
+
+
 class TimsData:
-    def __init__ (self, analysis_directory, use_recalibrated_state=False, pressure_compensation_strategy=PressureCompensationStrategy.NoPressureCompensation):
+    def __init__ (self, analysis_directory, use_recalibrated_state=False, pressure_compensation_strategy=PressureCompensationStrategy.NoPressureCompensation, immutable=True):
 
         if sys.version_info.major == 2:
             if not isinstance(analysis_directory, unicode):
@@ -132,16 +226,34 @@ class TimsData:
 
         self.dll = dll
 
-        self.handle = self.dll.tims_open_v2(
+        self.handle = self._open(analysis_directory, use_recalibrated_state, pressure_compensation_strategy)
+
+        # the analysis is never modified through this connection -> open read-only and immutable,
+        # unless it is still being written by the acquisition (immutable=False)
+        self.conn = connectAnalysisTdf(analysis_directory, immutable)
+
+        self.initial_frame_buffer_size = 128 # may grow in readScans()
+
+        self._frames = None
+
+        # buffers reused by readScansDllBuffer(reuse_buffer=True) and readScansArrays()
+        self._buffer_sized = False
+        self._read_buffer = None
+        self._index_buffer = None
+        self._intensity_buffer = None
+
+    def _open(self, analysis_directory, use_recalibrated_state, pressure_compensation_strategy):
+        """Open the analysis in the timsdata library and return its handle (overridden by other backends)."""
+        if self.dll is None:
+            raise RuntimeError("The timsdata library could not be loaded: {0}".format(dll_load_error))
+
+        handle = self.dll.tims_open_v2(
             analysis_directory.encode('utf-8'),
             1 if use_recalibrated_state else 0,
             pressure_compensation_strategy.value )
-        if self.handle == 0:
+        if handle == 0:
             _throwLastTimsDataError(self.dll)
-
-        self.conn = sqlite3.connect(os.path.join(analysis_directory, "analysis.tdf"))
-
-        self.initial_frame_buffer_size = 128 # may grow in readScans()
+        return handle
 
     def __enter__(self):
         return self
@@ -160,6 +272,22 @@ class TimsData:
             self.conn.close()
             self.conn = None
 
+    @property
+    def frames(self):
+        """The Frames table as a NumPy structured array ordered by Id (see FRAME_COLUMNS).
+
+        Loaded with a single query on first access and cached afterwards.
+
+        """
+        if self._frames is None:
+            available = set(row[1] for row in self.conn.execute("PRAGMA table_info(Frames)"))
+            columns = [(name, dtype) for name, dtype in FRAME_COLUMNS if name in available]
+            # NULL becomes NaN in float columns but has no integer representation
+            selection = ", ".join(name if dtype == np.float64 else "IFNULL({0}, 0)".format(name) for name, dtype in columns)
+            rows = self.conn.execute("SELECT {0} FROM Frames ORDER BY Id".format(selection)).fetchall()
+            self._frames = np.array(rows, dtype=columns)
+        return self._frames
+
     def __callConversionFunc (self, frame_id, input_data, func):
 
         if type(input_data) is np.ndarray and input_data.dtype == np.float64:
@@ -199,17 +327,37 @@ class TimsData:
     def voltageToScanNum (self, frame_id, voltages):
         return self.__callConversionFunc(frame_id, voltages, self.dll.tims_voltage_to_scannum)
 
-    def readScansDllBuffer (self, frame_id, scan_begin, scan_end):
+    def frameBufferSize (self):
+        """Number of uint32 values needed to read the largest frame, from Frames.NumScans/NumPeaks."""
+        frames = self.frames
+        if len(frames) == 0 or 'NumPeaks' not in frames.dtype.names:
+            return 0
+        return int((frames['NumScans'].astype(np.int64) + 2 * frames['NumPeaks'].astype(np.int64)).max())
+
+    def readScansDllBuffer (self, frame_id, scan_begin, scan_end, reuse_buffer=False):
         """Read a range of scans from a frame, returning the data in the low-level buffer format defined for
         the 'tims_read_scans_v2' DLL function (see documentation in 'timsdata.h').
 
+        With reuse_buffer=True the result is a view into a buffer owned by this object, which is
+        overwritten by the next call.
+
         """
-        
+
+        if not self._buffer_sized:
+            # start with the size of the largest frame instead of growing by failed reads
+            self.initial_frame_buffer_size = max(self.initial_frame_buffer_size, self.frameBufferSize())
+            self._buffer_sized = True
+
         # buffer-growing loop
         while True:
             cnt = int(self.initial_frame_buffer_size) # necessary cast to run with python 3.5
-            buf = np.empty(shape=cnt, dtype=np.uint32)
-            len = 4 * cnt
+            if reuse_buffer:
+                if self._read_buffer is None or self._read_buffer.size < cnt:
+                    self._read_buffer = np.empty(shape=cnt, dtype=np.uint32)
+                buf = self._read_buffer
+            else:
+                buf = np.empty(shape=cnt, dtype=np.uint32)
+            len = 4 * buf.size
 
             required_len = self.dll.tims_read_scans_v2(self.handle, frame_id, scan_begin, scan_end,
                                                     buf.ctypes.data_as(POINTER(c_uint32)),
@@ -225,8 +373,41 @@ class TimsData:
             else:
                 break
 
+        if reuse_buffer:
+            return buf[:required_len // 4]
         return buf
 
+    def readScansArrays (self, frame_id, scan_begin, scan_end):
+        """Read a range of scans from a frame, returning (offsets, indices, intensities).
+
+        The peaks of scan scan_begin+i are indices[offsets[i]:offsets[i+1]] and
+        intensities[offsets[i]:offsets[i+1]]. indices and intensities are views into buffers owned
+        by this object and are overwritten by the next call; copy them to keep them.
+
+        """
+
+        buf = self.readScansDllBuffer(frame_id, scan_begin, scan_end, reuse_buffer=True)
+
+        d = scan_end - scan_begin
+        counts = buf[:d].astype(np.int64)
+        offsets = np.zeros(d + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        num_peaks = int(offsets[-1])
+
+        if self._index_buffer is None or self._index_buffer.size < num_peaks:
+            size = max(num_peaks, int(self.initial_frame_buffer_size) // 2)
+            self._index_buffer = np.empty(shape=size, dtype=np.uint32)
+            self._intensity_buffer = np.empty(shape=size, dtype=np.uint32)
+        indices = self._index_buffer[:num_peaks]
+        intensities = self._intensity_buffer[:num_peaks]
+
+        # every scan stores its indices followed by its intensities
+        positions = np.arange(num_peaks) + np.repeat(d + offsets[:-1], counts)
+        np.take(buf, positions, out=indices)
+        positions += np.repeat(counts, counts)
+        np.take(buf, positions, out=intensities)
+        return offsets, indices, intensities
+
     def readScans (self, frame_id, scan_begin, scan_end):
         """Read a range of scans from a frame, returning a list of scans, each scan being represented as a
         tuple (index_array, intensity_array).
@@ -247,6 +428,50 @@ class TimsData:
             
         return result
 
+    def iter_frames (self, frame_ids=None, scan_range=None, msms_type=None):
+        """Yield a FrameRecord for each frame, reading one frame at a time.
+
+        frame_ids selects frames in the given order (default: all frames by Id), scan_range
+        (scan_begin, scan_end) restricts the scans read from every frame, or from each frame if it
+        holds one such pair per selected frame, and msms_type keeps only frames of the given
+        MsMsType (a value or a list of values). The arrays of a record are views into buffers that
+        are reused for the next frame; copy them to keep them.
+
+        """
+        frames = self.frames
+        if frame_ids is None:
+            rows = np.arange(len(frames))
+        else:
+            frame_ids = np.asarray(frame_ids, dtype=np.int64)
+            rows = np.searchsorted(frames['Id'], frame_ids)
+            if np.any(rows >= len(frames)) or np.any(frames['Id'][np.minimum(rows, len(frames) - 1)] != frame_ids):
+                raise ValueError("Unknown frame id.")
+        scan_ranges = None
+        if scan_range is not None:
+            scan_ranges = np.asarray(scan_range, dtype=np.int64).reshape(-1, 2)
+            if len(scan_ranges) == 1:
+                scan_ranges = np.repeat(scan_ranges, len(rows), axis=0)
+            elif len(scan_ranges) != len(rows):
+                raise ValueError("Expected one scan range per frame.")
+        if msms_type is not None:
+            keep = np.isin(frames['MsMsType'][rows], msms_type)
+            rows = rows[keep]
+            if scan_ranges is not None:
+                scan_ranges = scan_ranges[keep]
+
+        for position, (frame_id, num_scans) in enumerate(zip(frames['Id'][rows].tolist(), frames['NumScans'][rows].tolist())):
+            scan_begin, scan_end = 0, num_scans
+            if scan_ranges is not None:
+                scan_begin = min(max(int(scan_ranges[position, 0]), 0), num_scans)
+                scan_end = min(max(int(scan_ranges[position, 1]), scan_begin), num_scans)
+            if scan_begin == scan_end:
+                # e.g. a mobility window outside the axis of this frame; the library reports an
+                # empty read as an error, so it is not asked
+                yield FrameRecord(frame_id, scan_begin, scan_end, np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32))
+                continue
+            offsets, indices, intensities = self.readScansArrays(frame_id, scan_begin, scan_end)
+            yield FrameRecord(frame_id, scan_begin, scan_end, offsets, indices, intensities)
+
     # read some peak-picked MS/MS spectra for a given list of precursors; returns a dict mapping
     # 'precursor_id' to a pair of arrays (mz_values, area_values).
     def readPasefMsMs (self, precursor_list):
@@ -426,3 +651,30 @@ class TimsData:
 
         if rc == 0:
             _throwLastTimsDataError(self.dll)
+
+
+def timsDataBackend (backend=None):
+    """Name of the TimsData backend openTimsData uses for backend (None: TDFEXTRACT_BACKEND, then 'dll')."""
+    if backend is None:
+        backend = os.environ.get('TDFEXTRACT_BACKEND', 'dll')
+    return backend
+
+def openTimsData (analysis_directory, use_recalibrated_state=False, pressure_compensation_strategy=PressureCompensationStrategy.NoPressureCompensation, backend=None, immutable=True):
+    """Open an analysis with the TimsData implementation selected by backend.
+
+    backend defaults to the TDFEXTRACT_BACKEND environment variable (inherited by worker
+    processes), then to 'dll'. 'native' reads analysis.tdf_bin with NumPy (see timsdata_native),
+    'synthetic' opens analyses written by timsdata_synthetic. Pass immutable=False for an analysis
+    that is still being acquired.
+
+    """
+    backend = timsDataBackend(backend)
+    if backend == 'dll':
+        return TimsData(analysis_directory, use_recalibrated_state, pressure_compensation_strategy, immutable)
+    if backend == 'native':
+        from timsdata_native import NativeTimsData
+        return NativeTimsData(analysis_directory, use_recalibrated_state, pressure_compensation_strategy, immutable)
+    if backend == 'synthetic':
+        from timsdata_synthetic import SyntheticTimsData
+        return SyntheticTimsData(analysis_directory, use_recalibrated_state, pressure_compensation_strategy, immutable)
+    raise ValueError("Unknown TimsData backend: {0}".format(backend))
@@ -16,19 +16,16 @@ ccs = oneOverK0ToCCSforMz(1.1846, 1, 946.7764)
 print("CCS for 1/K0 1.1846, charge 1, mass 946.7764 : {0}".format(ccs))
 
 td = TimsData(analysis_dir, use_recalibrated_state=False, pressure_compensation_strategy=PressureCompensationStrategy.AnalyisGlobalPressureCompensation)
-conn = td.conn
+frames = td.frames
 
 # Get total frame count:
-q = conn.execute("SELECT COUNT(*) FROM Frames")
-row = q.fetchone()
-N = row[0]
+N = len(frames)
 print("Analysis has {0} frames.".format(N))
 
 
 # Get a projected mass spectrum:
 frame_id = 30
-q = conn.execute("SELECT NumScans FROM Frames WHERE Id={0}".format(frame_id))
-num_scans = q.fetchone()[0]
+num_scans = int(frames['NumScans'][frames['Id'] == frame_id][0])
 
 numplotbins = 500;
 min_mz = 0
@@ -36,14 +33,13 @@ max_mz = 3000
 mzbins = np.linspace(min_mz, max_mz, numplotbins)
 summed_intensities = np.zeros(numplotbins+1)
 
-for scan in td.readScans(frame_id, 0, num_scans):
-    index = np.array(scan[0], dtype=np.float64)
-    mz = td.indexToMz(frame_id, index)
+for frame in td.iter_frames([frame_id]):
+    mz = td.indexToMz(frame_id, frame.indices)
     if len(mz) > 0:
-        plotbins = np.digitize(mz, mzbins)
-        intens = scan[1]
-        for i in range(0, len(intens)):
-            summed_intensities[plotbins[i]] += intens[i]
+        np.add.at(summed_intensities, np.digitize(mz, mzbins), frame.intensities)
+
+# Stream all MS1 frames (MsMsType 0) with constant memory, e.g. for a total ion count per frame:
+tic = {frame.frame_id: int(frame.intensities.sum()) for frame in td.iter_frames(msms_type=0)}
 
 # Get list of scanned mobilities
 scan_number_axis = np.arange(num_scans, dtype=np.float64)
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""TimsData backend reading analysis.tdf_bin directly with NumPy (no timsdata.dll)"""
+import os
+import mmap
+import argparse
+import warnings
+import numpy as np
+from timsdata import TimsData, PressureCompensationStrategy
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def encode_frame(indices, intensities, counts):
+    """Encode one frame as a tdf_bin frame blob (zstd, TimsCompressionType 2).
+
+    The inverse of NativeTimsData.readScansArrays, used to write test data.
+
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    scan_count = len(counts)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    # TOF indices are stored +1 and delta-encoded within each scan
+    shifted = np.asarray(indices, dtype=np.int64) + 1
+    deltas = shifted - np.concatenate([[0], shifted[:-1]])
+    deltas[offsets[:-1][counts > 0]] = shifted[offsets[:-1][counts > 0]]
+
+    buffer = np.empty(scan_count + 2 * len(shifted), dtype=np.uint32)
+    buffer[0] = scan_count
+    buffer[1:scan_count] = 2 * counts[:-1]
+    buffer[scan_count::2] = deltas
+    buffer[scan_count + 1::2] = intensities
+
+    # the four bytes of every value are stored in separate planes
+    planes = buffer.view(np.uint8).reshape(-1, 4).T.tobytes()
+    compressed = zstandard.ZstdCompressor().compress(planes)
+    return np.array([8 + len(compressed), scan_count], dtype=np.uint32).tobytes() + compressed
+
+class NativeTimsData(TimsData):
+    """TimsData reading the frames of analysis.tdf_bin through a memory map.
+
+    Frame blobs are located by Frames.TimsId, decompressed with zstandard and decoded with NumPy.
+    The m/z and 1/K0 calibrations are approximated from the acquisition ranges in
+    GlobalMetadata, so converted values differ slightly from the DLL. Neither recalibration nor
+    pressure compensation is applied; asking for compensation gives a warning. Needs the
+    optional zstandard package.
+
+    """
+
+    def _open(self, analysis_directory, use_recalibrated_state, pressure_compensation_strategy):
+        if zstandard is None:
+            raise RuntimeError("The native TimsData backend needs the zstandard package.")
+        if pressure_compensation_strategy != PressureCompensationStrategy.NoPressureCompensation:
+            warnings.warn("The native TimsData backend applies no pressure compensation; the mobility axis is uncompensated "
+                          "({0} was requested).".format(pressure_compensation_strategy.name))
+        self._bin_file = open(os.path.join(analysis_directory, 'analysis.tdf_bin'), 'rb')
+        self._bin = mmap.mmap(self._bin_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._metadata = None
+        return None
+
+    def close(self):
+        if getattr(self, '_bin', None) is not None:
+            self._bin.close()
+            self._bin = None
+        if getattr(self, '_bin_file', None) is not None:
+            self._bin_file.close()
+            self._bin_file = None
+        super().close()
+
+    @property
+    def metadata(self):
+        """The GlobalMetadata table as a dict of strings."""
+        if self._metadata is None:
+            self._metadata = dict(self.conn.execute("SELECT Key, Value FROM GlobalMetadata").fetchall())
+            compression_type = int(self._metadata.get('TimsCompressionType', 2))
+            if compression_type != 2:
+                raise RuntimeError("Unsupported TimsCompressionType {0}.".format(compression_type))
+        return self._metadata
+
+    def _mzCalibration(self):
+        metadata = self.metadata
+        offset = np.sqrt(float(metadata['MzAcqRangeLower']))
+        return offset, (np.sqrt(float(metadata['MzAcqRangeUpper'])) - offset) / float(metadata['DigitizerNumSamples'])
+
+    def _mobilityCalibration(self):
+        metadata = self.metadata
+        ko_max = float(metadata['OneOverK0AcqRangeUpper'])
+        return ko_max, (ko_max - float(metadata['OneOverK0AcqRangeLower'])) / int(self.frames['NumScans'].max())
+
+    def indexToMz (self, frame_id, indices):
+        offset, slope = self._mzCalibration()
+        return (offset + slope * np.asarray(indices, dtype=np.float64)) ** 2
+
+    def mzToIndex (self, frame_id, mzs):
+        offset, slope = self._mzCalibration()
+        return (np.sqrt(np.asarray(mzs, dtype=np.float64)) - offset) / slope
+
+    def scanNumToOneOverK0 (self, frame_id, scan_nums):
+        ko_max, step = self._mobilityCalibration()
+        return ko_max - step * np.asarray(scan_nums, dtype=np.float64)
+
+    def oneOverK0ToScanNum (self, frame_id, mobilities):
+        ko_max, step = self._mobilityCalibration()
+        return (ko_max - np.asarray(mobilities, dtype=np.float64)) / step
+
+    def scanNumToVoltage (self, frame_id, scan_nums):
+        raise RuntimeError("Voltage conversion needs the timsdata library.")
+
+    def voltageToScanNum (self, frame_id, voltages):
+        raise RuntimeError("Voltage conversion needs the timsdata library.")
+
+    def _frameRow(self, frame_id):
+        frames = self.frames
+        row = int(np.searchsorted(frames['Id'], frame_id))
+        if row >= len(frames) or frames['Id'][row] != frame_id:
+            raise ValueError("Unknown frame id {0}.".format(frame_id))
+        return frames[row]
+
+    def readFrameBuffer (self, frame_id):
+        """Decompress one frame blob; returns (scan_count, buffer of uint32)."""
+        frame = self._frameRow(frame_id)
+        offset = int(frame['TimsId'])
+        bin_size, scan_count = np.frombuffer(self._bin[offset:offset + 8], dtype=np.uint32).tolist()
+        if bin_size <= 8 or frame['NumPeaks'] == 0:
+            return int(frame['NumScans']), np.zeros(0, dtype=np.uint32)
+
+        # decompress straight from the memory map; the output size is known from the Frames table
+        data = self._decompressor.decompress(memoryview(self._bin)[offset + 8:offset + bin_size],
+                                             max_output_size=4 * (scan_count + 2 * int(frame['NumPeaks'])))
+        planes = np.frombuffer(data, dtype=np.uint8).reshape(4, -1)
+        return scan_count, np.ascontiguousarray(planes.T).view(np.uint32).ravel()
+
+    def readScansArrays (self, frame_id, scan_begin, scan_end):
+        """Read a range of scans from a frame, returning (offsets, indices, intensities).
+
+        Same layout as TimsData.readScansArrays; indices and intensities are views into the
+        decoded frame, which is not reused.
+
+        """
+        scan_count, buffer = self.readFrameBuffer(frame_id)
+        num_peaks = (len(buffer) - scan_count) // 2 if len(buffer) else 0
+
+        counts = np.zeros(max(scan_count, scan_end), dtype=np.int64)
+        if num_peaks:
+            counts[:scan_count - 1] = buffer[1:scan_count] // 2
+            counts[scan_count - 1] = num_peaks - counts[:scan_count - 1].sum()
+        scan_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        first, last = int(scan_offsets[scan_begin]), int(scan_offsets[scan_end])
+        pairs = buffer[scan_count:scan_count + 2 * num_peaks].reshape(-1, 2)[first:last]
+        counts = counts[scan_begin:scan_end]
+
+        # undo the per-scan delta encoding: running sum minus the sum before the scan, minus one
+        running = np.cumsum(pairs[:, 0], dtype=np.int64)
+        scan_start = np.repeat(np.concatenate([[0], running])[scan_offsets[scan_begin:scan_end] - first], counts)
+        indices = (running - scan_start - 1).astype(np.uint32)
+        intensities = pairs[:, 1]
+        return scan_offsets[scan_begin:scan_end + 1] - first, indices, intensities
+
+    def readScansDllBuffer (self, frame_id, scan_begin, scan_end, reuse_buffer=False):
+        """Build the 'tims_read_scans_v2' buffer layout from the decoded frame."""
+        offsets, indices, intensities = self.readScansArrays(frame_id, scan_begin, scan_end)
+        counts = np.diff(offsets)
+        d = scan_end - scan_begin
+        buf = np.empty(shape=d + 2 * len(indices), dtype=np.uint32)
+        buf[:d] = counts
+        positions = np.arange(len(indices)) + np.repeat(d + offsets[:-1], counts)
+        buf[positions] = indices
+        buf[positions + np.repeat(counts, counts)] = intensities
+        return buf
+
+def validate_against_dll(analysis_directory, frame_ids=None, max_frames=50):
+    """Compare NativeTimsData with the DLL on the given frames (default: up to max_frames spread over the analysis).
+
+    Returns a dict with the number of frames compared, the frames whose peaks differ and the
+    largest m/z (ppm) and 1/K0 differences of the approximate calibrations.
+
+    """
+    with TimsData(analysis_directory) as td, NativeTimsData(analysis_directory) as native:
+        if frame_ids is None:
+            all_ids = td.frames['Id']
+            frame_ids = all_ids[np.unique(np.linspace(0, len(all_ids) - 1, min(max_frames, len(all_ids))).astype(np.int64))]
+        num_scans_by_id = dict(zip(td.frames['Id'].tolist(), td.frames['NumScans'].tolist()))
+        mismatched = []
+        mz_ppm = 0.0
+        ko_difference = 0.0
+        for frame_id in (int(frame_id) for frame_id in frame_ids):
+            num_scans = num_scans_by_id[frame_id]
+            expected = [array.copy() for array in td.readScansArrays(frame_id, 0, num_scans)]
+            actual = native.readScansArrays(frame_id, 0, num_scans)
+            if not all(np.array_equal(a, b) for a, b in zip(expected, actual)):
+                mismatched.append(frame_id)
+            if len(expected[1]):
+                mz = td.indexToMz(frame_id, expected[1])
+                mz_ppm = max(mz_ppm, float(np.max(np.abs(native.indexToMz(frame_id, expected[1]) - mz) / mz * 1e6)))
+            scans = np.arange(num_scans)
+            ko_difference = max(ko_difference, float(np.max(np.abs(native.scanNumToOneOverK0(frame_id, scans) - td.scanNumToOneOverK0(frame_id, scans)))))
+    return {'frames': len(frame_ids), 'mismatched_frames': mismatched, 'max_mz_ppm': mz_ppm, 'max_ook0_difference': ko_difference}
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate the native tdf_bin reader against timsdata.dll.')
+    parser.add_argument('input_folder', type=str, help='Path to the input .d folder')
+    parser.add_argument('--max_frames', type=int, default=50, help='Number of frames to compare')
+    args = parser.parse_args()
+
+    result = validate_against_dll(args.input_folder, max_frames=args.max_frames)
+    print(f"{result['frames']} frames compared, {len(result['mismatched_frames'])} with different peaks {result['mismatched_frames'][:10]}")
+    print(f"calibration: max m/z difference {result['max_mz_ppm']:.2f} ppm, max 1/K0 difference {result['max_ook0_difference']:.5f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""Synthetic analyses and a TimsData backend that reads them without timsdata.dll"""
+import os
+import json
+import sqlite3
+import argparse
+import numpy as np
+from timsdata import TimsData, PressureCompensationStrategy, FRAME_COLUMNS
+
+DEFAULT_PARAMETERS = {
+    'num_frames': 100,
+    'num_scans': 400,
+    'peaks_per_scan': 20,   # mean of the Poisson distributed peak count of a scan
+    'seed': 0,
+    'max_index': 400000,
+    'max_intensity': 1000,
+    'msms_every': 0,        # every n-th frame is a MS/MS frame (MsMsType 8), 0 for MS1 only
+    'recalibrate_at': 0,    # frames from this id on have TimsCalibration 2 and a shifted 1/K0 axis, 0 for one calibration
+    'mz_min': 100.0,
+    'mz_max': 3000.0,
+    'ko_min': 0.6,
+    'ko_max': 1.6,
+    'write_tdf_bin': False, # also write the peaks to analysis.tdf_bin (needs zstandard)
+}
+
+# presets for benchmark.py
+SCALES = {
+    'small': {'num_frames': 50, 'num_scans': 200, 'peaks_per_scan': 10},
+    'medium': {'num_frames': 500, 'num_scans': 600, 'peaks_per_scan': 20},
+    'large': {'num_frames': 2000, 'num_scans': 900, 'peaks_per_scan': 40},
+}
+
+def frame_peaks(parameters, frame_id):
+    """Return (counts, indices, intensities) of a synthetic frame; indices are sorted within each scan.
+
+    The data only depends on the parameters and frame_id, so it is regenerated identically on
+    every read.
+
+    """
+    rng = np.random.default_rng([parameters['seed'], frame_id])
+    counts = rng.poisson(parameters['peaks_per_scan'], parameters['num_scans']).astype(np.uint32)
+    num_peaks = int(counts.sum())
+    scan_numbers = np.repeat(np.arange(parameters['num_scans']), counts)
+    indices = rng.integers(1, parameters['max_index'], num_peaks, dtype=np.uint32)
+    indices = indices[np.lexsort((indices, scan_numbers))]
+    intensities = rng.integers(1, parameters['max_intensity'], num_peaks, dtype=np.uint32)
+    return counts, indices, intensities
+
+def tims_calibration(parameters, frame_id):
+    """Return the TimsCalibration of a synthetic frame."""
+    return 2 if parameters['recalibrate_at'] and frame_id >= parameters['recalibrate_at'] else 1
+
+def write_synthetic_analysis(analysis_directory, **parameters):
+    """Write the analysis.tdf of a synthetic analysis and return its parameters.
+
+    Only the Frames and GlobalMetadata tables are written; the peaks are generated on read by
+    SyntheticTimsData. With write_tdf_bin the peaks are also stored in analysis.tdf_bin for
+    NativeTimsData, with calibration metadata matching SyntheticTimsData without pressure
+    compensation and recalibration.
+
+    """
+    parameters = dict(DEFAULT_PARAMETERS, **parameters)
+    os.makedirs(analysis_directory, exist_ok=True)
+    tdf_path = os.path.join(analysis_directory, 'analysis.tdf')
+    if os.path.exists(tdf_path):
+        os.remove(tdf_path)
+
+    bin_file = None
+    if parameters['write_tdf_bin']:
+        from timsdata_native import encode_frame
+        bin_file = open(os.path.join(analysis_directory, 'analysis.tdf_bin'), 'wb')
+
+    rows = []
+    for frame_id in range(1, parameters['num_frames'] + 1):
+        counts = np.random.default_rng([parameters['seed'], frame_id]).poisson(parameters['peaks_per_scan'], parameters['num_scans'])
+        tims_id = 0
+        if bin_file is not None:
+            tims_id = bin_file.tell()
+            bin_file.write(encode_frame(*frame_peaks(parameters, frame_id)[1:], counts))
+        msms_type = 8 if parameters['msms_every'] and frame_id % parameters['msms_every'] == 0 else 0
+        values = {
+            'Id': frame_id, 'Time': 0.1 * frame_id, 'ScanMode': 9 if msms_type else 0, 'MsMsType': msms_type,
+            'TimsId': tims_id, 'MaxIntensity': 0, 'SummedIntensities': 0,
+            'NumScans': parameters['num_scans'], 'NumPeaks': int(counts.sum()),
+            'MzCalibration': 1, 'T1': 25.0, 'T2': 25.0, 'TimsCalibration': tims_calibration(parameters, frame_id), 'PropertyGroup': 1,
+            'AccumulationTime': 100.0, 'RampTime': 100.0, 'Pressure': 2.5 + 0.001 * np.sin(frame_id / 25.0),
+        }
+        rows.append(tuple(values[name] for name, _ in FRAME_COLUMNS))
+    if bin_file is not None:
+        bin_file.close()
+
+    metadata = {
+        'SyntheticParameters': json.dumps(parameters),
+        'TimsCompressionType': 2,
+        'MzAcqRangeLower': parameters['mz_min'],
+        'MzAcqRangeUpper': parameters['mz_max'],
+        'DigitizerNumSamples': parameters['max_index'],
+        'OneOverK0AcqRangeLower': parameters['ko_min'],
+        'OneOverK0AcqRangeUpper': parameters['ko_max'],
+    }
+
+    conn = sqlite3.connect(tdf_path)
+    try:
+        columns = ", ".join("{0} {1}".format(name, "REAL" if dtype == np.float64 else "INTEGER") for name, dtype in FRAME_COLUMNS)
+        conn.execute("CREATE TABLE Frames ({0}, PRIMARY KEY (Id))".format(columns))
+        conn.executemany("INSERT INTO Frames VALUES ({0})".format(", ".join("?" * len(FRAME_COLUMNS))), rows)
+        conn.execute("CREATE TABLE GlobalMetadata (Key TEXT PRIMARY KEY, Value TEXT)")
+        conn.executemany("INSERT INTO GlobalMetadata VALUES (?, ?)", [(key, str(value)) for key, value in metadata.items()])
+        conn.commit()
+    finally:
+        conn.close()
+    return parameters
+
+def write_synthetic_batch(parent_directory, num_analyses=4, **parameters):
+    """Write num_analyses synthetic analyses named like '<n>_<voltage>V.d' and return their paths."""
+    paths = []
+    for n in range(num_analyses):
+        path = os.path.join(parent_directory, f"synthetic{n + 1}_{10 * (n + 1)}V.d")
+        write_synthetic_analysis(path, **dict(parameters, seed=parameters.get('seed', 0) + n))
+        paths.append(path)
+    return paths
+
+class SyntheticTimsData(TimsData):
+    """TimsData over an analysis written by write_synthetic_analysis.
+
+    Supports the Frames table, the scan readers and the index/mobility/voltage conversions; the
+    calibrations are simple closed-form functions. Methods that need the timsdata library (PASEF
+    spectra, chromatograms) are not available.
+
+    """
+
+    def _open(self, analysis_directory, use_recalibrated_state, pressure_compensation_strategy):
+        self.pressure_compensation_strategy = pressure_compensation_strategy
+        self._parameters = None
+        if not os.path.exists(os.path.join(analysis_directory, 'analysis.tdf')):
+            raise RuntimeError("No analysis.tdf in {0}".format(analysis_directory))
+        return None
+
+    @property
+    def parameters(self):
+        if self._parameters is None:
+            row = self.conn.execute("SELECT Value FROM GlobalMetadata WHERE Key = 'SyntheticParameters'").fetchone()
+            if row is None:
+                raise RuntimeError("Not a synthetic analysis.")
+            self._parameters = dict(DEFAULT_PARAMETERS, **json.loads(row[0]))
+        return self._parameters
+
+    def _mobilityShift(self, frame_id):
+        shift = 0.01 * (tims_calibration(self.parameters, frame_id) - 1)
+        if self.pressure_compensation_strategy == PressureCompensationStrategy.NoPressureCompensation:
+            return shift
+        if self.pressure_compensation_strategy == PressureCompensationStrategy.AnalyisGlobalPressureCompensation:
+            return shift + 0.002
+        return shift + 0.002 + 0.001 * np.sin(frame_id / 25.0)
+
+    def _mzCalibration(self):
+        p = self.parameters
+        offset = np.sqrt(p['mz_min'])
+        return offset, (np.sqrt(p['mz_max']) - offset) / p['max_index']
+
+    def indexToMz (self, frame_id, indices):
+        offset, slope = self._mzCalibration()
+        return (offset + slope * np.asarray(indices, dtype=np.float64)) ** 2
+
+    def mzToIndex (self, frame_id, mzs):
+        offset, slope = self._mzCalibration()
+        return (np.sqrt(np.asarray(mzs, dtype=np.float64)) - offset) / slope
+
+    def scanNumToOneOverK0 (self, frame_id, scan_nums):
+        p = self.parameters
+        step = (p['ko_max'] - p['ko_min']) / p['num_scans']
+        return p['ko_max'] + self._mobilityShift(frame_id) - step * np.asarray(scan_nums, dtype=np.float64)
+
+    def oneOverK0ToScanNum (self, frame_id, mobilities):
+        p = self.parameters
+        step = (p['ko_max'] - p['ko_min']) / p['num_scans']
+        return (p['ko_max'] + self._mobilityShift(frame_id) - np.asarray(mobilities, dtype=np.float64)) / step
+
+    def scanNumToVoltage (self, frame_id, scan_nums):
+        return 200.0 - 0.25 * np.asarray(scan_nums, dtype=np.float64)
+
+    def voltageToScanNum (self, frame_id, voltages):
+        return (200.0 - np.asarray(voltages, dtype=np.float64)) / 0.25
+
+    def readScansDllBuffer (self, frame_id, scan_begin, scan_end, reuse_buffer=False):
+        """Build the 'tims_read_scans_v2' buffer of a synthetic frame."""
+        counts, indices, intensities = frame_peaks(self.parameters, frame_id)
+        offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+        counts = counts[scan_begin:scan_end]
+        first, last = offsets[scan_begin], offsets[scan_end]
+        d = scan_end - scan_begin
+
+        buf = np.empty(shape=d + 2 * (last - first), dtype=np.uint32)
+        buf[:d] = counts
+        positions = np.arange(last - first) + np.repeat(d + offsets[scan_begin:scan_end] - first, counts)
+        buf[positions] = indices[first:last]
+        buf[positions + np.repeat(counts, counts)] = intensities[first:last]
+        return buf
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic .d analyses for the synthetic TimsData backend (TDFEXTRACT_BACKEND=synthetic).')
+    parser.add_argument('output_folder', type=str, help='Folder to write the .d analyses to')
+    parser.add_argument('--analyses', type=int, default=4, help='Number of analyses')
+    parser.add_argument('--scale', choices=sorted(SCALES), help='Preset for frames, scans and peaks')
+    parser.add_argument('--frames', type=int, help='Frames per analysis')
+    parser.add_argument('--scans', type=int, help='Scans per frame')
+    parser.add_argument('--peaks', type=float, help='Mean number of peaks per scan')
+    parser.add_argument('--msms_every', type=int, default=0, help='Make every n-th frame a MS/MS frame')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--tdf_bin', action='store_true', help='Also write analysis.tdf_bin for the native backend (needs zstandard)')
+    args = parser.parse_args()
+
+    parameters = dict(SCALES[args.scale]) if args.scale else {}
+    for name, value in (('num_frames', args.frames), ('num_scans', args.scans), ('peaks_per_scan', args.peaks)):
+        if value is not None:
+            parameters[name] = value
+    for path in write_synthetic_batch(args.output_folder, args.analyses, msms_every=args.msms_every, seed=args.seed, write_tdf_bin=args.tdf_bin, **parameters):
+        print(path)
+
+if __name__ == '__main__':
+    main()
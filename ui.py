@@ -3,7 +3,10 @@ from tkinter import messagebox, filedialog
 from ttkbootstrap import Style, ttk
 import threading
 import pandas as pd
-from processing import process_data, process_batch_data
+from processing import process_single_data, process_batch_data, parse_values, mz_windows, frame_selection_options, mobility_range_option
+from progress import ProgressChannel
+from result_cache import ResultCache
+from output_writers import OUTPUT_FORMATS
 from tkinter import PhotoImage
 import sys
 import os
@@ -11,24 +14,73 @@ import os
 if getattr(sys, 'frozen', False):
     bundle_dir = sys._MEIPASS
     dll_path = os.path.join(bundle_dir, 'timsdata.dll')
-    os.add_dll_directory(os.path.dirname(dll_path))
+    if hasattr(os, 'add_dll_directory'):  # Windows only
+        os.add_dll_directory(os.path.dirname(dll_path))
 else:
-    os.add_dll_directory(os.getcwd())
+    if hasattr(os, 'add_dll_directory'):  # Windows only
+        os.add_dll_directory(os.getcwd())
     bundle_dir = os.path.dirname(os.path.abspath(__file__))
 
 icon_path = os.path.join(bundle_dir, 'fingerprint.png')
 
 def create_ui():
     global mzmin_var, mzmax_var, charge_var, mz_value_var
-    global recalibrated_var, pressure_compensation_var, ccs_conversion_var
+    global recalibrated_var, pressure_compensation_var, ccs_conversion_var, workers_var, cache_size_var
+    global mobility_bin_width_var, mobility_bin_count_var, output_format_var
+    global rt_min_var, rt_max_var, frame_ranges_var, msms_types_var, mobility_min_var, mobility_max_var
     global extraction_method_var, sort_columns_var, progress_var, status_var
-    global process_button, batch_button, root
+    global process_button, batch_button, cancel_button, root
     
     root = tk.Tk()  # Initialize root window
     
     recalibrated_var = tk.BooleanVar(value=True)  
     pressure_compensation_var = tk.StringVar(value="Global")
+    workers_var = tk.IntVar(value=1)
+    cache_size_var = tk.IntVar(value=1024)  # MB, 0 disables the result cache
+    mobility_bin_width_var = tk.DoubleVar(value=0)  # 0 keeps the native scan axis
+    mobility_bin_count_var = tk.IntVar(value=0)
+    output_format_var = tk.StringVar(value="csv")
+    rt_min_var = tk.StringVar(value="")  # empty fields keep all frames
+    rt_max_var = tk.StringVar(value="")
+    frame_ranges_var = tk.StringVar(value="")
+    msms_types_var = tk.StringVar(value="")
+    mobility_min_var = tk.StringVar(value="")  # 1/K0, or CCS when converting to CCS
+    mobility_max_var = tk.StringVar(value="")
+    running_channel = []  # ProgressChannel of the running extraction, if any
+
+    def create_cache():
+        if cache_size_var.get() <= 0:
+            return None
+        return ResultCache(max_bytes=cache_size_var.get() * 1024 * 1024)
     
+    def start_job(target, button, busy_text, idle_text, **kwargs):
+        # the worker thread only pushes events to the channel; this thread applies them on a timer.
+        # Only one job runs at a time, so both start buttons stay disabled until it is done
+        channel = ProgressChannel()
+        running_channel[:] = [channel]
+        button.config(text=busy_text)
+        for start_button in (process_button, batch_button):
+            start_button.config(state="disabled")
+        cancel_button.config(state="normal")
+
+        def on_done():
+            running_channel.clear()
+            button.config(text=idle_text)
+            for start_button in (process_button, batch_button):
+                start_button.config(state="normal")
+            cancel_button.config(state="disabled")
+
+        thread = threading.Thread(target=target, kwargs=dict(kwargs, channel=channel), daemon=True)
+        thread.start()
+        channel.drain(root, status_var.set, lambda fraction: progress_var.set(fraction * 100),
+                      lambda message: messagebox.showerror("Error", message), on_done)
+
+    def on_cancel():
+        if running_channel:
+            running_channel[0].cancel()
+            status_var.set("Cancelling...")
+            cancel_button.config(state="disabled")
+
     def on_process():
         input_folder = filedialog.askdirectory(title="Select a folder containing .d files")
         if not input_folder:
@@ -36,10 +88,12 @@ def create_ui():
             return
         
         try:
-            mzmin = float(mzmin_var.get())
-            mzmax = float(mzmax_var.get())
-            charge = int(charge_var.get()) if ccs_conversion_var.get() else None
-            mz_value = float(mz_value_var.get()) if ccs_conversion_var.get() else None
+            # several windows can be entered as ';'-separated lists
+            mzmin = parse_values(mzmin_var.get())
+            mzmax = parse_values(mzmax_var.get())
+            charge = parse_values(charge_var.get(), int) if ccs_conversion_var.get() else None
+            mz_value = parse_values(mz_value_var.get()) if ccs_conversion_var.get() else None
+            mz_windows(mzmin, mzmax, charge, mz_value)
         except ValueError:
             messagebox.showerror("Error", "Invalid input value.")
             return
@@ -48,17 +102,22 @@ def create_ui():
         sort_columns = sort_columns_var.get()
         use_recalibrated_state = recalibrated_var.get()
         pressure_compensation_strategy = pressure_compensation_var.get()
+        workers = workers_var.get()
         
+        # the mobility window is given in CCS when the output is converted to CCS
+        mobility_window = {'ccs_min': mobility_min_var.get(), 'ccs_max': mobility_max_var.get()} if ccs_conversion_var.get() else \
+                          {'ko_min': mobility_min_var.get(), 'ko_max': mobility_max_var.get()}
+
         progress_var.set(0)
         status_var.set("Starting processing...")
-        root.update_idletasks()
-
-        process_button.config(text="Processing...", state="disabled")
-        
-        thread = threading.Thread(target=process_data, args=(input_folder, mzmin, mzmax, progress_var, status_var, process_button, root, extraction_method, sort_columns, ccs_conversion_var.get(), charge, mz_value, use_recalibrated_state, pressure_compensation_strategy))
-        thread.start()
 
-        root.update_idletasks()
+        start_job(process_single_data, process_button, "Processing...", "Select folder containing .d files",
+                  input_folder=input_folder, mzmin=mzmin, mzmax=mzmax, extraction_method=extraction_method, sort_columns=sort_columns,
+                  ccs_conversion=ccs_conversion_var.get(), charge=charge, mz_value=mz_value, use_recalibrated_state=use_recalibrated_state,
+                  pressure_compensation_strategy=pressure_compensation_strategy, workers=workers, cache=create_cache(),
+                  mobility_bin_width=mobility_bin_width_var.get(), mobility_bin_count=mobility_bin_count_var.get(), output_format=output_format_var.get(),
+                  rt_min=rt_min_var.get(), rt_max=rt_max_var.get(), frame_ranges=frame_ranges_var.get(), msms_types=msms_types_var.get(),
+                  **mobility_window)
 
     def on_batch_process():
         file_path = filedialog.askopenfilename(title="Select a CSV file", filetypes=[("CSV files", "*.csv")])
@@ -74,14 +133,8 @@ def create_ui():
         
         progress_var.set(0)
         status_var.set("Starting batch processing...")
-        root.update_idletasks()
-
-        batch_button.config(text="Batch Processing...", state="disabled")
-        
-        thread = threading.Thread(target=process_batch_data, args=(batch_data, progress_var, status_var, batch_button, root))
-        thread.start()
 
-        root.update_idletasks()
+        start_job(process_batch_data, batch_button, "Batch Processing...", "Batch Extraction", batch_data=batch_data, cache=create_cache())
 
     def toggle_ccs_conversion():
         if ccs_conversion_var.get():
@@ -99,11 +152,28 @@ def create_ui():
         def save_advanced_settings():
             recalibrated_var.set(recalibrated_check_var.get())
             pressure_compensation_var.set(pressure_compensation_var_popup.get())
+            output_format_var.set(output_format_var_popup.get())
+            try:
+                workers_var.set(max(1, int(workers_var_popup.get())))
+                cache_size_var.set(max(0, int(cache_size_var_popup.get())))
+                mobility_bin_width_var.set(max(0.0, float(mobility_bin_width_var_popup.get() or 0)))
+                mobility_bin_count_var.set(max(0, int(mobility_bin_count_var_popup.get() or 0)))
+                frame_selection_options(rt_min_var_popup.get(), rt_max_var_popup.get(), frame_ranges_var_popup.get(), msms_types_var_popup.get())
+                mobility_range_option(mobility_min_var_popup.get(), mobility_max_var_popup.get())
+            except ValueError:
+                messagebox.showerror("Error", "Invalid number of worker processes, cache size, mobility binning, frame selection or mobility window.")
+                return
+            mobility_min_var.set(mobility_min_var_popup.get())
+            mobility_max_var.set(mobility_max_var_popup.get())
+            rt_min_var.set(rt_min_var_popup.get())
+            rt_max_var.set(rt_max_var_popup.get())
+            frame_ranges_var.set(frame_ranges_var_popup.get())
+            msms_types_var.set(msms_types_var_popup.get())
             advanced_window.destroy()
 
         advanced_window = tk.Toplevel(root)
         advanced_window.title("Advanced Settings")
-        advanced_window.geometry("400x150")  
+        advanced_window.geometry("400x690")  
 
         recalibrated_check_var = tk.BooleanVar(value=recalibrated_var.get())
         ttk.Checkbutton(advanced_window, text="Use Recalibrated State", variable=recalibrated_check_var).grid(row=0, column=0, sticky=tk.W, padx=10, pady=10)
@@ -117,14 +187,59 @@ def create_ui():
         ], state="readonly")
         pressure_compensation_menu.grid(row=1, column=1, sticky=tk.W, padx=10, pady=10)
 
+        ttk.Label(advanced_window, text="Worker processes:").grid(row=2, column=0, sticky=tk.W, padx=10, pady=10)
+        workers_var_popup = tk.StringVar(value=str(workers_var.get()))
+        workers_spinbox = ttk.Spinbox(advanced_window, textvariable=workers_var_popup, from_=1, to=os.cpu_count() or 1, width=5)
+        workers_spinbox.grid(row=2, column=1, sticky=tk.W, padx=10, pady=10)
+
+        ttk.Label(advanced_window, text="Result cache size (MB, 0 = off):").grid(row=3, column=0, sticky=tk.W, padx=10, pady=10)
+        cache_size_var_popup = tk.StringVar(value=str(cache_size_var.get()))
+        ttk.Entry(advanced_window, textvariable=cache_size_var_popup, width=8).grid(row=3, column=1, sticky=tk.W, padx=10, pady=10)
+
+        ttk.Label(advanced_window, text="1/K0 bin width (0 = off):").grid(row=4, column=0, sticky=tk.W, padx=10, pady=10)
+        mobility_bin_width_var_popup = tk.StringVar(value=str(mobility_bin_width_var.get()))
+        ttk.Entry(advanced_window, textvariable=mobility_bin_width_var_popup, width=8).grid(row=4, column=1, sticky=tk.W, padx=10, pady=10)
+
+        ttk.Label(advanced_window, text="1/K0 bin count (0 = off):").grid(row=5, column=0, sticky=tk.W, padx=10, pady=10)
+        mobility_bin_count_var_popup = tk.StringVar(value=str(mobility_bin_count_var.get()))
+        ttk.Entry(advanced_window, textvariable=mobility_bin_count_var_popup, width=8).grid(row=5, column=1, sticky=tk.W, padx=10, pady=10)
+
+        ttk.Label(advanced_window, text="Output format:").grid(row=6, column=0, sticky=tk.W, padx=10, pady=10)
+        output_format_var_popup = tk.StringVar(value=output_format_var.get())
+        ttk.Combobox(advanced_window, textvariable=output_format_var_popup, values=list(OUTPUT_FORMATS), state="readonly", width=8).grid(row=6, column=1, sticky=tk.W, padx=10, pady=10)
+
+        ttk.Label(advanced_window, text="Retention time min (s):").grid(row=7, column=0, sticky=tk.W, padx=10, pady=10)
+        rt_min_var_popup = tk.StringVar(value=rt_min_var.get())
+        ttk.Entry(advanced_window, textvariable=rt_min_var_popup, width=8).grid(row=7, column=1, sticky=tk.W, padx=10, pady=10)
+
+        ttk.Label(advanced_window, text="Retention time max (s):").grid(row=8, column=0, sticky=tk.W, padx=10, pady=10)
+        rt_max_var_popup = tk.StringVar(value=rt_max_var.get())
+        ttk.Entry(advanced_window, textvariable=rt_max_var_popup, width=8).grid(row=8, column=1, sticky=tk.W, padx=10, pady=10)
+
+        ttk.Label(advanced_window, text="Frames (e.g. 1-500;800-900):").grid(row=9, column=0, sticky=tk.W, padx=10, pady=10)
+        frame_ranges_var_popup = tk.StringVar(value=frame_ranges_var.get())
+        ttk.Entry(advanced_window, textvariable=frame_ranges_var_popup, width=14).grid(row=9, column=1, sticky=tk.W, padx=10, pady=10)
+
+        ttk.Label(advanced_window, text="MsMsType (0 = MS1 only):").grid(row=10, column=0, sticky=tk.W, padx=10, pady=10)
+        msms_types_var_popup = tk.StringVar(value=msms_types_var.get())
+        ttk.Entry(advanced_window, textvariable=msms_types_var_popup, width=8).grid(row=10, column=1, sticky=tk.W, padx=10, pady=10)
+
+        ttk.Label(advanced_window, text="Mobility window min (1/K0 or CCS):").grid(row=11, column=0, sticky=tk.W, padx=10, pady=10)
+        mobility_min_var_popup = tk.StringVar(value=mobility_min_var.get())
+        ttk.Entry(advanced_window, textvariable=mobility_min_var_popup, width=8).grid(row=11, column=1, sticky=tk.W, padx=10, pady=10)
+
+        ttk.Label(advanced_window, text="Mobility window max (1/K0 or CCS):").grid(row=12, column=0, sticky=tk.W, padx=10, pady=10)
+        mobility_max_var_popup = tk.StringVar(value=mobility_max_var.get())
+        ttk.Entry(advanced_window, textvariable=mobility_max_var_popup, width=8).grid(row=12, column=1, sticky=tk.W, padx=10, pady=10)
+
         save_button = ttk.Button(advanced_window, text="Save", command=save_advanced_settings)
-        save_button.grid(row=2, column=0, columnspan=2, pady=10)
+        save_button.grid(row=13, column=0, columnspan=2, pady=10)
 
     style = Style(theme='flatly')  
     root.title("tdfExtract")
 
-    root.geometry('475x700')  
-    root.minsize(475, 700)  
+    root.geometry('475x770')  
+    root.minsize(475, 770)  
 
     root.iconphoto(False, PhotoImage(file=icon_path))
 
@@ -203,15 +318,12 @@ def create_ui():
     status_label = ttk.Label(frame, textvariable=status_var, font=("Helvetica", 12))
     status_label.grid(row=13, column=0, columnspan=2, sticky=(tk.W, tk.E))
 
+    cancel_button = ttk.Button(frame, text="Cancel", command=on_cancel, bootstyle="danger", padding=(10, 5), state="disabled")
+    cancel_button.grid(row=14, column=0, columnspan=2)
+
     for child in frame.winfo_children():
         child.grid_configure(padx=10, pady=10)
 
-    def update_status(status_message):
-        status_var.set(status_message)
-        root.update_idletasks()
-
-    process_data.update_status = update_status
-
     toggle_ccs_conversion()
 
     root.mainloop()